@@ -0,0 +1,90 @@
+"""
+Benchmark of the seasonal anomaly pipeline: global-first (before) vs subset-first (after).
+
+Runs on synthetic SEAS5-shaped data, so no GRIB files are needed:
+
+    python benchmarks/seasonal_pipeline.py --resolution 1.0 --members 51
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from climate_functions import calculate_season_anomalies_location, convert_prate_mm  # noqa: E402
+from geo_loc import ds_latlon_subset  # noqa: E402
+
+# define Kenya
+SUB = (5.5, 33, -5.5, 43)  # North, West, South, East
+
+
+def make_seasonal(members, resolution, start, seed):
+    latitude = np.arange(90, -90 - resolution / 2, -resolution)
+    longitude = np.arange(0, 360, resolution)
+    shape = (members, 6, latitude.size, longitude.size)
+    tprate = np.random.default_rng(seed).random(shape, dtype=np.float32) * 1e-7
+    return xr.Dataset(
+        {'tprate': (('number', 'forecastMonth', 'latitude', 'longitude'), tprate)},
+        coords={
+            'number': np.arange(members),
+            'forecastMonth': np.arange(1, 7),
+            'latitude': latitude,
+            'longitude': longitude,
+            'time': pd.Timestamp(start),
+        },
+    )
+
+
+def global_first(forecast, hindcast, sub):
+    """The pipeline before the reordering: reduce the whole globe, then crop."""
+    seas5_forecast_3m = forecast.rolling(forecastMonth=3).mean()
+    ds_hindcast_3m = hindcast.rolling(forecastMonth=3).mean()
+    ds_hindcast_3m_hindcast_mean = ds_hindcast_3m.mean(['number'])
+    anomalies = seas5_forecast_3m.tprate - ds_hindcast_3m_hindcast_mean.tprate
+    anomalies_em_tp = convert_prate_mm(anomalies.mean('number'))
+    return ds_latlon_subset(anomalies_em_tp, sub)
+
+
+def measure(func, *args, repeat):
+    timings = []
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, min(timings), peak / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--resolution', type=float, default=1.0)
+    parser.add_argument('--members', type=int, default=51)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    forecast = make_seasonal(args.members, args.resolution, '2024-05-01', seed=0)
+    hindcast = make_seasonal(args.members, args.resolution, '2024-05-01', seed=1).drop_vars('time')
+
+    before, before_s, before_mb = measure(global_first, forecast, hindcast, SUB, repeat=args.repeat)
+    after, after_s, after_mb = measure(
+        calculate_season_anomalies_location, forecast, hindcast, SUB, repeat=args.repeat
+    )
+    xr.testing.assert_allclose(before.drop_vars('time'), after.drop_vars('time'), atol=1e-3)
+
+    print(f"grid {forecast.latitude.size}x{forecast.longitude.size}, {args.members} members")
+    print(f"{'pipeline':<14}{'time (s)':>10}{'peak (MiB)':>12}")
+    print(f"{'global-first':<14}{before_s:>10.3f}{before_mb:>12.1f}")
+    print(f"{'subset-first':<14}{after_s:>10.3f}{after_mb:>12.1f}")
+    print(f"speed-up: {before_s / after_s:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""
+Memoized seasonal anomaly fields.
+
+The seasonal precipitation anomaly for a bounding box only changes when a new
+SEAS5 forecast or hindcast file is downloaded (monthly). Fields are cached in
+process memory and as NetCDF on disk, keyed by the content hash of both input
+files and the bounding box, so a request only pays for a single cell read.
+
+The hindcast reference of the anomalies is its own product: the 3-month rolling
+hindcast climatology per lead month is computed once per (system, start month,
+hindcast file) over the whole grid and stored on disk, so a new forecast issue
+only computes its own ensemble mean.
+"""
+import hashlib
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from cds_api_call import (SEASONAL_GRIB_FILES, SEASONAL_STORES, load_seasonal_forecast,
+                          seasonal_hindcast_request)
+from climate_functions import calculate_season_anomalies_location, hindcast_climatology
+from grid_index import get_grid_index
+
+# Bumped when the anomaly computation changes, so stale files on disk are not reused
+ANOMALY_CACHE_VERSION = 2
+
+_anomaly_cache = {}
+_climatology_cache = {}
+_digest_cache = {}
+_lock = threading.Lock()
+_climatology_lock = threading.Lock()
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Returns a short sha256 digest of a file's contents.
+
+    Digests are memoized on (path, size, mtime), so unchanged files are only hashed once.
+    """
+    stat = os.stat(path)
+    stat_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if stat_key not in _digest_cache:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                digest.update(chunk)
+        _digest_cache[stat_key] = digest.hexdigest()[:16]
+    return _digest_cache[stat_key]
+
+
+def seasonal_source_digest(data_dir, kind):
+    """
+    Returns the file_digest of the 'forecast' or 'hindcast' GRIB file.
+
+    Without the GRIB file (deployments that ship the converted stores only) the
+    digest recorded by convert_seasonal_grib in the store is used.
+    """
+    grib_file = f'{data_dir}{SEASONAL_GRIB_FILES[kind]}'
+    if os.path.exists(grib_file):
+        return file_digest(grib_file)
+    store = f'{data_dir}{SEASONAL_STORES[kind]}'
+    stat = os.stat(store)
+    stat_key = (os.path.abspath(store), stat.st_ino, stat.st_mtime_ns)
+    if stat_key not in _digest_cache:
+        with xr.open_zarr(store, consolidated=True) as ds:
+            _digest_cache[stat_key] = ds.attrs['source_digest']
+    return _digest_cache[stat_key]
+
+
+def seasonal_files_version(data_dir):
+    """Identifies the current forecast/hindcast pair, e.g. for invalidating derived caches."""
+    forecast_digest = seasonal_source_digest(data_dir, 'forecast')
+    hindcast_digest = seasonal_source_digest(data_dir, 'hindcast')
+    return f'{forecast_digest}_{hindcast_digest}'
+
+
+def _start_months(ds):
+    return sorted(set(pd.DatetimeIndex(np.atleast_1d(ds.time.values)).month))
+
+
+def get_hindcast_climatology(data_dir, hindcast=None, cache_dir=None, index_dir=None):
+    """
+    Returns the hindcast_climatology of the current hindcast file over the whole grid,
+    computing it at most once per (system, start month, hindcast file).
+
+    Args:
+    - data_dir (str): Data directory holding the SEAS5 GRIB files or their converted stores.
+    - hindcast (xarray.Dataset): The hindcast of load_seasonal_forecast, loaded if not given.
+    - cache_dir (str): Where to store the NetCDF product, defaults to {data_dir}cache/.
+    - index_dir (str): Directory for the cfgrib indexes, config['cfgrib_index_dir'].
+
+    Returns:
+    - xarray.DataArray: Rolling 3-month hindcast mean precipitation rate per forecastMonth.
+    """
+    cache_dir = cache_dir or f'{data_dir}cache/'
+    request = seasonal_hindcast_request(data_dir).request
+    key = (request['system'], int(request['month']), seasonal_source_digest(data_dir, 'hindcast'))
+    if key in _climatology_cache:
+        return _climatology_cache[key]
+
+    with _climatology_lock:
+        if key in _climatology_cache:
+            return _climatology_cache[key]
+
+        system, start_month, digest = key
+        cache_path = os.path.join(cache_dir, f'seas5_hindcast_climatology_s{system}_m{start_month:02d}_{digest}.nc')
+        if os.path.exists(cache_path):
+            with xr.open_dataarray(cache_path) as cached:
+                climatology = cached.load()
+        else:
+            if hindcast is None:
+                hindcast = load_seasonal_forecast(data_dir, index_dir)[1]
+            if _start_months(hindcast) != [start_month]:
+                raise ValueError(f"{SEASONAL_GRIB_FILES['hindcast']} has start months {_start_months(hindcast)}, "
+                                 f'expected {start_month} from the hindcast request')
+            climatology = hindcast_climatology(hindcast.tprate).load()
+            climatology.attrs.update(system=system, start_month=start_month)
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+                climatology.to_netcdf(tmp_path)
+                os.replace(tmp_path, cache_path)
+            except OSError:
+                pass
+
+        _climatology_cache[key] = climatology
+        return climatology
+
+
+def get_season_anomalies(data_dir, sub, cache_dir=None, index_dir=None):
+    """
+    Returns calculate_season_anomalies_location for the current seasonal files and bbox,
+    computing it at most once per (forecast file, hindcast file, bbox).
+
+    Args:
+    - data_dir (str): Data directory holding the SEAS5 GRIB files or their converted stores.
+    - sub (tuple): Bounding box (North, West, South, East).
+    - cache_dir (str): Where to store the NetCDF cache, defaults to {data_dir}cache/.
+    - index_dir (str): Directory for the cfgrib indexes, config['cfgrib_index_dir'].
+
+    Returns:
+    - xarray.DataArray: Seasonal precipitation anomaly (mm) over the bounding box.
+    """
+    cache_dir = cache_dir or f'{data_dir}cache/'
+    key = (seasonal_files_version(data_dir), tuple(float(v) for v in sub))
+    if key in _anomaly_cache:
+        return _anomaly_cache[key]
+
+    with _lock:
+        if key in _anomaly_cache:
+            return _anomaly_cache[key]
+
+        bbox = '_'.join(f'{v:g}' for v in key[1])
+        cache_path = os.path.join(cache_dir, f'season_anomalies_v{ANOMALY_CACHE_VERSION}_{key[0]}_{bbox}.nc')
+        if os.path.exists(cache_path):
+            with xr.open_dataarray(cache_path) as cached:
+                anomalies = cached.load()
+        else:
+            forecast, hindcast = load_seasonal_forecast(data_dir, index_dir)
+            climatology = get_hindcast_climatology(data_dir, hindcast, cache_dir, index_dir)
+            if _start_months(forecast) != [climatology.attrs['start_month']]:
+                raise ValueError(f"forecast start months {_start_months(forecast)} differ from "
+                                 f"the hindcast start month {climatology.attrs['start_month']}")
+            anomalies = calculate_season_anomalies_location(forecast, hindcast, sub, climatology).load()
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+                anomalies.to_netcdf(tmp_path)
+                os.replace(tmp_path, cache_path)
+            except OSError:
+                pass
+
+        get_grid_index(anomalies, latname='latitude', lonname='longitude')
+        _anomaly_cache[key] = anomalies
+        return anomalies
@@ -7,22 +7,21 @@ from streamlit_folium import st_folium
 import folium
 
 
-from cds_api_call import load_hist_proj, load_seasonal_forecast
-from climate_functions import calculate_season_anomalies_location, extract_cordex_climate_data, extract_seasonal_data
-from geo_loc import get_lat_lon, get_soil_from_api
+from anomaly_cache import get_season_anomalies, seasonal_files_version
+from cds_api_call import load_cordex_climatology
+from consult import run_consultation
+from event_index import load_event_indexes
+from geo_loc import get_lat_lon
+from llm_client import get_model_client
+from llm_stream import StreamHandler
+from prompt_context import DEFAULT_CONTEXT_BUDGET, build_chat_prompt, build_climate_context, prompt_template_text
+from request_context import build_enrichers, gather_request_context
+from semantic_cache import get_semantic_cache
 # from postgres_query import read_data_db
 # from event_prox_functions import filter_events_within_square
 
-from langchain.callbacks.base import BaseCallbackHandler
-from langchain.prompts.chat import (
-    ChatPromptTemplate,
-    SystemMessagePromptTemplate,
-    HumanMessagePromptTemplate,
-)
 from langchain_community.chat_models.ollama import ChatOllama
-from langchain_openai import ChatOpenAI
 from ollama_functions import OllamaFunctions
-from langchain.chains import LLMChain
 from langchain_core.pydantic_v1 import BaseModel
 
 
@@ -33,41 +32,24 @@ with open(config_path, 'r') as file:
     config = yaml.safe_load(file)
 
 data_dir = config['data_dir']
-db_engine_url = config['db_engine_url']
 tables = config['table_names']
 distance_from_event = config['distance_from_event']
 seasons_ke = config['seasons_ke']
 system_role = config['system_role']
+enricher_timeouts = config.get('enricher_timeouts')
+cfgrib_index_dir = config.get('cfgrib_index_dir')
+semantic_cache_config = config.get('semantic_cache')
+semantic_cache = get_semantic_cache(**semantic_cache_config) if semantic_cache_config else None
+# Shared by all sessions: pooled connections, warm model, coalesced requests
+llm = get_model_client(**config.get('ollama', {}))
+context_budget = config.get('prompt_budget', {}).get('context_tokens', DEFAULT_CONTEXT_BUDGET)
 
-content_message = "{user_message} \n \
-      Location: latitude = {lat}, longitude = {lon} \
-      Current soil type: {soil} \
-      Current mean monthly temperature for each month: {hist_temp_str} \
-      Future monthly temperatures for each month at the location: {future_temp_str}\
-      Current precipitation flux (mm/month): {hist_pr_str} \
-      Future precipitation flux (mm/month): {future_pr_str} \
-      Current seasonal precipitation anomaly: {current_season_pr_anomaly}\
-      "
-
-class StreamHandler(BaseCallbackHandler):
-    """
-    Taken from here: https://discuss.streamlit.io/t/langchain-stream/43782
-    """
-
-    def __init__(self, container, initial_text="", display_method="markdown"):
-        self.container = container
-        self.text = initial_text
-        self.display_method = display_method
-
-    def on_llm_new_token(self, token: str, **kwargs) -> None:
-        self.text += token
-        display_function = getattr(self.container, self.display_method, None)
-        if display_function is not None:
-            display_function(self.text)
-        else:
-            raise ValueError(f"Invalid display_method: {self.display_method}")
-        
+@st.cache_resource
+def event_indexes():
+    # Event tables held in memory once per process, queried by filter_events_within_square
+    return load_event_indexes(tables, **config.get('event_index', {}))
 
+event_indexes()
 
 
 class AnswerWithJustification(BaseModel):
@@ -75,8 +57,7 @@ class AnswerWithJustification(BaseModel):
     answer: str
     justification: str
 
-historical, projection = load_hist_proj(data_dir=data_dir)
-forecast, hindcast = load_seasonal_forecast(data_dir=data_dir)
+historical, projection = load_cordex_climatology(data_dir=data_dir)
 
 # print(forecast)
 
@@ -137,56 +118,54 @@ if submit_button and user_message and location:
             }], zoom=12
         )
 
-        try:
-            soil_type = get_soil_from_api(lat, lon)
-        except:
-            soil_type = "Not known"
-        
         # define Kenya 
         sub = (5.5, 33, -5.5, 43) #North, West, South, East
 
-        df, data_dict = extract_cordex_climate_data(lat, lon, historical, projection)
-        seasonal_anomalies = calculate_season_anomalies_location(forecast, hindcast, sub)
-        current_season_anomaly = extract_seasonal_data(lat, lon, seasonal_anomalies, seasons_ke)
+        seasonal_anomalies = get_season_anomalies(data_dir, sub, index_dir=cfgrib_index_dir)
+
+        # Soil, seasonal anomaly and CORDEX climatology are fetched concurrently
+        context, _ = gather_request_context(
+            build_enrichers(lat, lon, seasonal_anomalies=seasonal_anomalies, seasons=seasons_ke,
+                            historical=historical, projection=projection),
+            timeouts=enricher_timeouts,
+        )
+        soil_type = context['soil']
+        df = context['cordex']
+        current_season_anomaly = context['seasonal']
 
 
     with st.spinner("Generating..."):
+        st.subheader("Here is what you need to know", divider='rainbow')
         chat_box = st.empty()
-        stream_handler = StreamHandler(chat_box, display_method="write")
-        llm = ChatOpenAI(
-            openai_api_base = "http://localhost:11434/v1",
-            api_key= "ollama",
-            model="llama3",
-            temperature=0
-        )
+        stream_handler = StreamHandler(chat_box, display_method="markdown")
         # llm = OllamaFunctions(
         #     model="llama3", temperature=0
         # )
-        system_message_prompt = SystemMessagePromptTemplate.from_template(system_role)
-        human_message_prompt = HumanMessagePromptTemplate.from_template(content_message)
-        chat_prompt = ChatPromptTemplate.from_messages(
-            [system_message_prompt, human_message_prompt]
+        chat_prompt = build_chat_prompt(system_role)
+        climate_context, _ = build_climate_context(
+            soil=soil_type,
+            seasonal_anomaly=current_season_anomaly,
+            climatology=df,
+            seasons=seasons_ke,
+            budget=context_budget,
         )
-        chain = LLMChain(
-            llm=llm,
-            prompt=chat_prompt,
-            verbose=True,
-        ) 
-        output = chain.run(
+        prompt_inputs = dict(
             user_message=user_message,
             lat=str(lat),
             lon=str(lon),
-            soil=soil_type,
-            hist_temp_str=data_dict["hist_temp"],
-            future_temp_str=data_dict["future_temp"],
-            hist_pr_str=data_dict["hist_pr"],
-            future_pr_str=data_dict["future_pr"],
-            current_season_pr_anomaly = current_season_anomaly,
-            verbose=True,
+            climate_context=climate_context,
+        )
+        # Served from the exact or semantic answer cache when possible,
+        # otherwise tokens are streamed into chat_box as they arrive
+        output, _ = run_consultation(
+            chat_prompt,
+            llm,
+            stream_handler,
+            template=prompt_template_text(system_role),
+            forecast_version=seasonal_files_version(data_dir),
+            prompt_inputs=prompt_inputs,
+            semantic_cache=semantic_cache,
         )
-
-        st.subheader("Here is what you need to know", divider='rainbow')
-        st.markdown(output)
 
         # print(output)
 
@@ -196,7 +175,8 @@ if submit_button and user_message and location:
         st.markdown(f"**Coordinates:** {round(lat, 4)}, {round(lon, 4)}")
         st.markdown(f"**Soil type:** {soil_type}")
         
-        # Climate Data
+    # Climate Data
+    if show_add_info and df is not None:
         st.markdown("**Climate data:**")
         st.markdown(
             "Near surface temperature",
@@ -0,0 +1,277 @@
+"""
+Batch consultations: advisories for many farms in one job.
+
+    python batch_consult.py farms.csv advisories.jsonl --concurrency 4
+
+The input (CSV or Parquet) has one row per farm with farm_id, lat, lon, crop and
+question. The climate context is computed for all farms at once, farms that end
+up with identical prompts share one model call, and calls run with bounded
+concurrency and retry with backoff when the model server is overloaded or
+rate-limits. Every finished farm is appended to the JSONL output immediately;
+re-running the same command skips farms that already have an advisory, so an
+interrupted job resumes where it stopped.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import openai
+import pandas as pd
+import yaml
+from langchain_openai import ChatOpenAI
+
+from anomaly_cache import get_season_anomalies, seasonal_files_version
+from cds_api_call import load_cordex_climatology
+from climate_functions import extract_cordex_climate_data_batch, extract_seasonal_data_batch
+from geo_loc import SOIL_CACHE_PRECISION, get_soil_type
+from llm_cache import consultation_key, get_cached_response, put_cached_response
+from prompt_context import (
+    DEFAULT_CONTEXT_BUDGET,
+    build_chat_prompt,
+    build_climate_context,
+    prompt_template_text,
+)
+
+FARM_COLUMNS = ['farm_id', 'lat', 'lon', 'crop', 'question']
+
+
+def read_farms(path):
+    """Reads the farm list from a CSV or Parquet file."""
+    if path.endswith('.parquet'):
+        farms = pd.read_parquet(path)
+    else:
+        farms = pd.read_csv(path)
+    missing = set(FARM_COLUMNS) - set(farms.columns)
+    if missing:
+        raise ValueError(f"{path} is missing columns: {sorted(missing)}")
+    farms = farms[FARM_COLUMNS].copy()
+    farms['farm_id'] = farms['farm_id'].astype(str)
+    return farms
+
+
+def completed_farms(output_path):
+    """farm_ids that already have an advisory in the output file (the checkpoint)."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path) as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # partially written last line of an interrupted run
+            if record.get('error') is None:
+                done.add(record['farm_id'])
+    return done
+
+
+def soil_types(lats, lons, max_workers=8):
+    """Soil class per location, looked up once per distinct rounded coordinate."""
+    cells = list(zip(np.round(lats, SOIL_CACHE_PRECISION), np.round(lons, SOIL_CACHE_PRECISION)))
+    unique_cells = list(dict.fromkeys(cells))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        soils = dict(zip(unique_cells, executor.map(lambda cell: get_soil_type(*cell), unique_cells)))
+    return [soils[cell] for cell in cells]
+
+
+def build_farm_context(farms, data_dir, seasons, budget=DEFAULT_CONTEXT_BUDGET, margin=1.0, index_dir=None):
+    """
+    Prompt inputs for every farm, with the climate data computed vectorized over all farms.
+
+    Args:
+    - farms (pandas.DataFrame): Output of read_farms.
+    - data_dir (str): Data directory holding the SEAS5 and CORDEX files.
+    - seasons (list): Season names, e.g. config['seasons_ke'].
+    - budget (int): Token budget of each farm's climate context.
+    - margin (float): Degrees added around the farms' bounding box for the seasonal anomaly field.
+    - index_dir (str): Directory for the cfgrib indexes, config['cfgrib_index_dir'].
+
+    Returns:
+    - pandas.DataFrame: farms with one column per input of prompt_context.HUMAN_TEMPLATE.
+    """
+    lats = farms['lat'].to_numpy(dtype=float)
+    lons = farms['lon'].to_numpy(dtype=float)
+
+    sub = (lats.max() + margin, lons.min() - margin, lats.min() - margin, lons.max() + margin)
+    seasonal = extract_seasonal_data_batch(lats, lons, get_season_anomalies(data_dir, sub, index_dir=index_dir), seasons)
+    historical, projection = load_cordex_climatology(data_dir)
+    cordex = extract_cordex_climate_data_batch(lats, lons, historical, projection)
+    soils = soil_types(lats, lons)
+    anomalies = seasonal['anomaly_mm'].fillna("Not known").to_numpy()
+
+    climate_context = [
+        build_climate_context(
+            soil=soils[point],
+            seasonal_anomaly=anomalies[point],
+            climatology=climatology,
+            seasons=seasons,
+            budget=budget,
+        )[0]
+        for point, climatology in cordex.groupby('point', sort=True)
+    ]
+
+    context = farms.copy()
+    context['user_message'] = farms['question'] + " Crop: " + farms['crop'].astype(str)
+    context['lat'] = farms['lat'].astype(str)
+    context['lon'] = farms['lon'].astype(str)
+    context['climate_context'] = climate_context
+    return context
+
+
+# Rate limits (429), server errors (5xx), dropped connections and timeouts; anything
+# else (bad request, auth, context length) fails the same way on every attempt
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,  # includes APITimeoutError
+    openai.InternalServerError,
+)
+
+
+def _retry_after(error):
+    """Seconds the server asked us to wait (HTTP 429/503 Retry-After), if any."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+async def ainvoke_with_retry(llm, messages, max_retries=5, base_delay=1.0, max_delay=60.0):
+    """
+    Calls the model, retrying RETRYABLE_ERRORS with exponential backoff and jitter.
+    Other errors are raised at once.
+
+    A Retry-After header on a rate-limit or overload response takes precedence
+    over the computed backoff.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return (await llm.ainvoke(messages)).content
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = _retry_after(e)
+            if delay is None:
+                delay = random.uniform(0.5, 1.0) * min(max_delay, base_delay * 2 ** attempt)
+            print(f"model call failed ({e!r}), retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def run_batch(context, output_path, chat_prompt, llm, template, forecast_version,
+                    concurrency=4, max_retries=5):
+    """
+    Generates the advisories for all farms in context that are not in output_path yet.
+
+    Args:
+    - context (pandas.DataFrame): Output of build_farm_context.
+    - output_path (str): JSONL file that results are appended to; also the checkpoint.
+    - chat_prompt (ChatPromptTemplate): The system + human prompt.
+    - llm: Chat model.
+    - template (str): The prompt template text, part of the cache key.
+    - forecast_version (str): anomaly_cache.seasonal_files_version of the current forecast.
+    - concurrency (int): Maximum number of model calls in flight.
+    - max_retries (int): Retries per model call.
+
+    Returns:
+    - dict: Counts of farms written, unique prompts, cache hits, model calls and failures.
+    """
+    done = completed_farms(output_path)
+    todo = context[~context['farm_id'].isin(done)]
+    if todo.empty:
+        print(f"all {len(context)} farms already done")
+        return {'farms': 0, 'prompts': 0, 'cached': 0, 'llm': 0, 'failed': 0}
+
+    input_names = list(chat_prompt.input_variables)
+    keys = [
+        consultation_key(getattr(llm, 'model_name', ''), template, **dict(zip(input_names, row)))
+        for row in todo[input_names].itertuples(index=False)
+    ]
+    groups = todo.assign(_key=keys).groupby('_key', sort=False)
+    print(f"{len(todo)} farms ({len(done)} already done), {groups.ngroups} unique prompts")
+
+    stats = {'farms': 0, 'prompts': groups.ngroups, 'cached': 0, 'llm': 0, 'failed': 0}
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+
+    with open(output_path, 'a') as output:
+
+        def write(farm_ids, advisory, error):
+            for farm_id in farm_ids:
+                output.write(json.dumps({'farm_id': farm_id, 'advisory': advisory, 'error': error}) + "\n")
+            output.flush()
+            stats['farms'] += len(farm_ids)
+
+        async def consult(key, group):
+            inputs = group.iloc[0][input_names].to_dict()
+            advisory = get_cached_response(key, forecast_version)
+            if advisory is not None:
+                stats['cached'] += 1
+                write(list(group['farm_id']), advisory, None)
+                return
+            async with semaphore:
+                try:
+                    advisory = await ainvoke_with_retry(
+                        llm, chat_prompt.format_messages(**inputs), max_retries=max_retries
+                    )
+                except Exception as e:
+                    stats['failed'] += 1
+                    write(list(group['farm_id']), None, repr(e))
+                    return
+            stats['llm'] += 1
+            put_cached_response(key, forecast_version, advisory)
+            write(list(group['farm_id']), advisory, None)
+
+        await asyncio.gather(*(consult(key, group) for key, group in groups))
+
+    print(f"batch finished in {time.perf_counter() - start:.1f}s: {stats}")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate advisories for many farms.")
+    parser.add_argument('farms', help="CSV or Parquet with farm_id, lat, lon, crop, question")
+    parser.add_argument('output', help="JSONL output, appended to and used to resume")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--max-retries', type=int, default=5)
+    parser.add_argument('--model', default="llama3")
+    parser.add_argument('--base-url', default="http://localhost:11434/v1")
+    args = parser.parse_args(argv)
+
+    with open(os.getenv('CONFIG_PATH', 'config.yaml'), 'r') as file:
+        config = yaml.safe_load(file)
+    data_dir = config['data_dir']
+    system_role = config['system_role']
+
+    budget = config.get('prompt_budget', {}).get('context_tokens', DEFAULT_CONTEXT_BUDGET)
+    context = build_farm_context(read_farms(args.farms), data_dir, config['seasons_ke'], budget=budget,
+                                 index_dir=config.get('cfgrib_index_dir'))
+    chat_prompt = build_chat_prompt(system_role)
+    llm = ChatOpenAI(
+        openai_api_base=args.base_url,
+        api_key="ollama",
+        model=args.model,
+        temperature=0,
+        max_retries=0,  # retried in ainvoke_with_retry
+    )
+    asyncio.run(
+        run_batch(
+            context,
+            args.output,
+            chat_prompt,
+            llm,
+            template=prompt_template_text(system_role),
+            forecast_version=seasonal_files_version(data_dir),
+            concurrency=args.concurrency,
+            max_retries=args.max_retries,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
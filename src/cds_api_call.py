@@ -45,8 +45,14 @@ urllib3.disable_warnings() # Disable "InsecureRequestWarning"
                            # for data download via API
 
 import os
+import shutil
 from dotenv import load_dotenv
 
+from cds_download import CDSRequest, download_all, file_sha256
+from cordex_ingest import CORDEX_STORES
+from climate_functions import convert_to_mm_per_month
+from grid_index import get_grid_index
+
 load_dotenv()
 
 # Fetch AWS credentials from environment variables
@@ -63,8 +69,8 @@ def call_api(url=URL, key=KEY):
     client = cdsapi.Client(url=url, key=key)
     return client
 
-def retrieve_cordex_historical(client, data_dir):
-    client.retrieve(
+def cordex_historical_request(data_dir):
+    return CDSRequest(
         'projections-cordex-domains-single-levels',
         {
             'format': 'zip',
@@ -81,9 +87,12 @@ def retrieve_cordex_historical(client, data_dir):
         },
         f'{data_dir}1971-2000_cordex_historical_africa.zip')
 
+def retrieve_cordex_historical(client, data_dir):
+    client.retrieve(*cordex_historical_request(data_dir))
 
-def retrieve_cordex_projection(client, data_dir):
-    client.retrieve(
+
+def cordex_projection_request(data_dir):
+    return CDSRequest(
         'projections-cordex-domains-single-levels',
         {
             'format': 'zip',
@@ -100,6 +109,9 @@ def retrieve_cordex_projection(client, data_dir):
         },
         f'{data_dir}2071-2100_cordex_rcp_4_5_africa.zip')
 
+def retrieve_cordex_projection(client, data_dir):
+    client.retrieve(*cordex_projection_request(data_dir))
+
 def unzip_files(data_dir):
     cordex_zip_paths = glob(f'{data_dir}*.zip')
     for j in cordex_zip_paths:
@@ -107,7 +119,7 @@ def unzip_files(data_dir):
             zip_ref.extractall(f'{data_dir}')
 
 # @st.cache_data
-# def load_hist_proj(data_dir):
+def load_hist_proj(data_dir):
 #     # Initialize a boto3 session
 #     session = boto3.Session(
 #         aws_access_key_id=aws_access_key_id,
@@ -166,12 +178,71 @@ def unzip_files(data_dir):
 #     # finally:
 #     #     client.close()
 
+    # Zarr stores written by ingest_cordex_archives; the extracted NetCDFs are the fallback
+    stores = [f'{data_dir}{CORDEX_STORES[experiment]}' for experiment in ('historical', 'rcp45')]
+    if all(os.path.exists(store) for store in stores):
+        return tuple(xr.open_zarr(store, consolidated=True) for store in stores)
+
     hist_data = xr.open_mfdataset(f'{data_dir}*CanESM2_historical*.nc')
     proj_data = xr.open_mfdataset(f'{data_dir}*CanESM2_rcp45*.nc')
     return hist_data, proj_data
 
-def retrieve_seasonal_hist(client, data_dir):
-    client.retrieve(
+CLIMATOLOGY_FILES = {
+    'historical': 'cordex_historical_climatology.nc',
+    'rcp45': 'cordex_rcp45_climatology.nc',
+}
+
+def reduce_to_climatology(data):
+    """
+    Reduces a daily CORDEX dataset to a 12-month climatology cube.
+
+    Args:
+    - data (xarray.Dataset): Daily dataset with 'tas' (K) and 'pr' (kg m-2 s-1).
+
+    Returns:
+    - xarray.Dataset: 'tas' (K) and 'pr' (mm/month) on a 'month' dimension.
+    """
+    tas = data['tas'].groupby('time.month').mean()
+    pr = convert_to_mm_per_month(data['pr']).drop_vars('numdays')
+    climatology = xr.Dataset({'tas': tas, 'pr': pr})
+    climatology['tas'].attrs['units'] = 'K'
+    climatology['pr'].attrs['units'] = 'mm/month'
+    return climatology
+
+def build_cordex_climatology(data_dir, chunks=(12, 64, 64)):
+    """
+    Offline build step: reduces the historical and RCP4.5 daily files once to
+    chunked 12-month climatology cubes, so the app never touches the raw data.
+    """
+    hist_data, proj_data = load_hist_proj(data_dir)
+    for experiment, data in (('historical', hist_data), ('rcp45', proj_data)):
+        climatology = reduce_to_climatology(data).compute()
+        encoding = {
+            var: {
+                'zlib': True,
+                'complevel': 4,
+                'chunksizes': tuple(min(c, n) for c, n in zip(chunks, climatology[var].shape)),
+            }
+            for var in ('tas', 'pr')
+        }
+        climatology.to_netcdf(f'{data_dir}{CLIMATOLOGY_FILES[experiment]}', encoding=encoding)
+
+@st.cache_resource
+def load_cordex_climatology(data_dir):
+    hist_clim = xr.open_dataset(f'{data_dir}{CLIMATOLOGY_FILES["historical"]}')
+    proj_clim = xr.open_dataset(f'{data_dir}{CLIMATOLOGY_FILES["rcp45"]}')
+    # Both experiments share the grid; built here once instead of on the first request
+    get_grid_index(hist_clim, latname='lat', lonname='lon')
+    return hist_clim, proj_clim
+
+SEASONAL_FORECAST_FILE = 'seasonal/ecmwf_seas5_2024_03_forecast_monthly_tp.grib'
+SEASONAL_HINDCAST_FILE = 'seasonal/ecmwf_seas5_2002-2022_05_hindcast_monthly_tp.grib'
+# Forecast and hindcast must share the start month: the anomaly is the forecast
+# minus the hindcast climatology of the same start month and lead times
+SEASONAL_START_MONTH = '05'
+
+def seasonal_hindcast_request(data_dir):
+    return CDSRequest(
         'seasonal-monthly-single-levels',
         {
             'format': 'grib',
@@ -188,17 +259,20 @@ def retrieve_seasonal_hist(client, data_dir):
                 '2017', '2018', '2019',
                 '2020', '2021', '2022',
             ],
-            'month': '03',
+            'month': SEASONAL_START_MONTH,
             'leadtime_month': [
                 '1', '2', '3',
                 '4', '5', '6',
             ],
         },
-        f'{data_dir}seasonal/ecmwf_seas5_2002-2022_05_hindcast_monthly_tp.grib')
+        f'{data_dir}{SEASONAL_HINDCAST_FILE}')
+
+def retrieve_seasonal_hist(client, data_dir):
+    client.retrieve(*seasonal_hindcast_request(data_dir))
     
-def retrieve_seasonal_proj(client, data_dir):
+def seasonal_forecast_request(data_dir):
     # # Forecast data request
-    client.retrieve(
+    return CDSRequest(
         'seasonal-monthly-single-levels',
         {
             'format': 'grib',
@@ -207,16 +281,94 @@ def retrieve_seasonal_proj(client, data_dir):
             'variable': 'total_precipitation',
             'product_type': 'monthly_mean',
             'year': '2024',
-            'month': '05',
+            'month': SEASONAL_START_MONTH,
             'leadtime_month': [
                 '1', '2', '3',
                 '4', '5', '6',
             ],
         },
-        f'{data_dir}seasonal/ecmwf_seas5_2024_03_forecast_monthly_tp.grib')
+        f'{data_dir}{SEASONAL_FORECAST_FILE}')
+
+def retrieve_seasonal_proj(client, data_dir):
+    client.retrieve(*seasonal_forecast_request(data_dir))
+
+SEASONAL_GRIB_FILES = {
+    'forecast': SEASONAL_FORECAST_FILE,
+    'hindcast': SEASONAL_HINDCAST_FILE,
+}
+SEASONAL_STORES = {
+    'forecast': 'seasonal/ecmwf_seas5_forecast_monthly_tp.zarr',
+    'hindcast': 'seasonal/ecmwf_seas5_hindcast_monthly_tp.zarr',
+}
+# cfgrib writes its .idx sidecars next to the GRIB by default, and re-scans every
+# message on each open when the data dir is read-only. Used when config.yaml has
+# no cfgrib_index_dir.
+CFGRIB_INDEX_DIR = os.getenv('CFGRIB_INDEX_DIR')
+
+def open_seasonal_grib(path, index_dir=None):
+    """
+    Opens a SEAS5 GRIB file with cfgrib, keeping its index in index_dir if given.
+
+    Args:
+    - path (str): GRIB file.
+    - index_dir (str): Persistent, writable directory for the cfgrib indexes,
+      config['cfgrib_index_dir']; defaults to CFGRIB_INDEX_DIR.
+    """
+    index_dir = index_dir or CFGRIB_INDEX_DIR
+    backend_kwargs = dict(time_dims=('forecastMonth', 'time'))
+    if index_dir:
+        os.makedirs(index_dir, exist_ok=True)
+        # short_hash changes with the GRIB file, so a re-downloaded file gets a new index
+        backend_kwargs['indexpath'] = os.path.join(index_dir, f'{basename(path)}.{{short_hash}}.idx')
+    return xr.open_dataset(path, engine='cfgrib', backend_kwargs=backend_kwargs)
+
+def seasonal_store_is_current(data_dir, kind):
+    """
+    Whether the converted store exists and is not older than its GRIB file.
+
+    A store without its GRIB file is current, so a deployment can ship the stores
+    only; the store then identifies its source by the 'source_digest' attribute.
+    """
+    store = f'{data_dir}{SEASONAL_STORES[kind]}'
+    grib_file = f'{data_dir}{SEASONAL_GRIB_FILES[kind]}'
+    if not os.path.exists(store):
+        return False
+    return not os.path.exists(grib_file) or os.path.getmtime(store) >= os.path.getmtime(grib_file)
+
+def convert_seasonal_grib(data_dir, index_dir=None, spatial_chunk=16):
+    """
+    Offline build step: converts the forecast and hindcast GRIB files once to
+    consolidated Zarr stores, so the app opens them without a cfgrib scan.
+
+    Chunks hold all members, start dates and lead months of a spatial tile, since
+    the app reads every forecastMonth at one location or bounding box.
+
+    Args:
+    - data_dir (str): Data directory holding the SEAS5 GRIB files.
+    - index_dir (str): Persistent directory for the cfgrib indexes.
+    - spatial_chunk (int): Grid cells per chunk along latitude and longitude.
+    """
+    for kind, grib_file in SEASONAL_GRIB_FILES.items():
+        if seasonal_store_is_current(data_dir, kind):
+            print(f'{data_dir}{SEASONAL_STORES[kind]}: up to date, skipped')
+            continue
+        with open_seasonal_grib(f'{data_dir}{grib_file}', index_dir) as ds:
+            chunks = {dim: (spatial_chunk if dim in ('latitude', 'longitude') else -1) for dim in ds.dims}
+            ds = ds.chunk(chunks)
+            # same digest as anomaly_cache.file_digest of the GRIB file
+            ds.attrs['source_digest'] = file_sha256(f'{data_dir}{grib_file}')[:16]
+            for var in ds.variables.values():
+                var.encoding.pop('chunks', None)
+            # written next to the store and swapped in, so a failed conversion never looks current
+            store = f'{data_dir}{SEASONAL_STORES[kind]}'
+            ds.to_zarr(f'{store}.tmp', mode='w', consolidated=True)
+            if os.path.exists(store):
+                shutil.rmtree(store)
+            os.rename(f'{store}.tmp', store)
+        print(f'{data_dir}{SEASONAL_STORES[kind]}: converted from {grib_file}')
 
 @st.cache_data
-def load_seasonal_forecast(data_dir):
+def load_seasonal_forecast(data_dir, index_dir=None):
 
     # try:
 
@@ -237,9 +389,12 @@ def load_seasonal_forecast(data_dir):
     # except Exception as e:
     #     print(f"An error occurred: {e}")
 
-    seas5_forecast = xr.open_dataset(f'{data_dir}seasonal/ecmwf_seas5_2024_03_forecast_monthly_tp.grib', engine='cfgrib', 
-                                 backend_kwargs=dict(time_dims=('forecastMonth', 'time')))
-    ds_hindcast = xr.open_dataset(f'{data_dir}seasonal/ecmwf_seas5_2002-2022_05_hindcast_monthly_tp.grib', engine='cfgrib', backend_kwargs=dict(time_dims=('forecastMonth', 'time')))
+    seas5_forecast, ds_hindcast = (
+        xr.open_zarr(f'{data_dir}{SEASONAL_STORES[kind]}', consolidated=True)
+        if seasonal_store_is_current(data_dir, kind)
+        else open_seasonal_grib(f'{data_dir}{grib_file}', index_dir)
+        for kind, grib_file in SEASONAL_GRIB_FILES.items()
+    )
     return seas5_forecast, ds_hindcast
 
 if __name__ == "__main__":
@@ -251,10 +406,17 @@ if __name__ == "__main__":
     data_dir = config['data_dir']
 
     client = call_api()
-    # retrieve_cordex_historical(client, data_dir)
-    # retrieve_cordex_projection(client, data_dir)
-    retrieve_seasonal_hist(client, data_dir)
-    retrieve_seasonal_proj(client, data_dir)
-    # unzip_files(data_dir)
+    # Submitted concurrently; up-to-date targets are skipped, partial downloads resumed
+    cds_requests = [
+        # cordex_historical_request(data_dir),
+        # cordex_projection_request(data_dir),
+        seasonal_hindcast_request(data_dir),
+        seasonal_forecast_request(data_dir),
+    ]
+    download_all(client, cds_requests, data_dir, **config.get('cds_download', {}))
+    # from cordex_ingest import ingest_cordex_archives
+    # ingest_cordex_archives(data_dir, **config.get('cordex_ingest', {}))
+    # build_cordex_climatology(data_dir)
+    convert_seasonal_grib(data_dir, config.get('cfgrib_index_dir'))
 
 
@@ -0,0 +1,217 @@
+"""
+Parallel, resumable downloads from the Copernicus Climate Data Store.
+
+`client.retrieve(dataset, request, target)` blocks for the whole CDS queue time
+plus the download and starts over on any failure, so the monthly refresh took
+the sum of all requests. download_all takes a declarative list of CDSRequests
+and
+
+- submits them concurrently, up to max_workers at a time,
+- downloads each result with HTTP range requests into `<target>.part`, resuming
+  from the bytes already on disk after a failure or restart,
+- skips targets whose sha256 matches the manifest entry for the same request,
+- records dataset, request hash, result location, size and sha256 per target in
+  a JSON manifest.
+
+The client only needs the cdsapi interface `retrieve(dataset, request)` returning
+a result with `location` and `content_length`; tests/test_cds_download.py runs
+it against a local stand-in CDS server that drops connections mid-download.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+CDSRequest = namedtuple('CDSRequest', ['dataset', 'request', 'target'])
+
+MANIFEST_NAME = 'cds_manifest.json'
+CHUNK_SIZE = 1 << 20
+
+_manifest_lock = threading.Lock()
+
+
+def request_hash(cds_request):
+    """Identifies a request by its dataset and parameters."""
+    payload = json.dumps([cds_request.dataset, cds_request.request], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as file:
+        return json.load(file)
+
+
+def _update_manifest(manifest_path, target, entry):
+    with _manifest_lock:
+        manifest = load_manifest(manifest_path)
+        manifest[target] = entry
+        tmp_path = f'{manifest_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(manifest, file, indent=2, sort_keys=True)
+        os.replace(tmp_path, manifest_path)
+
+
+def is_up_to_date(cds_request, manifest):
+    """Whether the target exists and matches the manifest entry of the same request."""
+    entry = manifest.get(cds_request.target)
+    return (
+        entry is not None
+        and entry.get('request_hash') == request_hash(cds_request)
+        and entry.get('sha256') is not None
+        and os.path.exists(cds_request.target)
+        and os.path.getsize(cds_request.target) == entry.get('size')
+        and file_sha256(cds_request.target) == entry['sha256']
+    )
+
+
+def download_resumable(url, target, content_length=None, retries=5, timeout=60, session=None):
+    """
+    Downloads url to target, continuing `<target>.part` with a range request if it exists.
+
+    Args:
+    - url (str): Location of the result.
+    - target (str): Final path; only written (atomically) once the download is complete.
+    - content_length (int): Expected size in bytes, checked when given.
+    - retries (int): Attempts before giving up; each attempt resumes where the last stopped.
+    - timeout (float): Seconds to wait for the server per read.
+    - session (requests.Session): Optional session to reuse connections.
+    """
+    session = session or requests.Session()
+    part_path = f'{target}.part'
+    for attempt in range(1, retries + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if content_length is not None and offset == content_length:
+            break
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 416:
+                    # Range beyond the end: the part file is complete or stale, start over
+                    os.remove(part_path)
+                    continue
+                response.raise_for_status()
+                mode = 'ab' if offset and response.status_code == 206 else 'wb'
+                with open(part_path, mode) as file:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        file.write(chunk)
+            size = os.path.getsize(part_path)
+            if content_length is None or size == content_length:
+                break
+            print(f'{target}: got {size} of {content_length} bytes, resuming')
+        except requests.RequestException as e:
+            if attempt == retries:
+                raise
+            delay = min(60, 2 ** attempt)
+            print(f'{target}: download failed ({e!r}), retry {attempt}/{retries} in {delay}s')
+            time.sleep(delay)
+    else:
+        raise IOError(f'{target}: incomplete after {retries} attempts')
+
+    os.replace(part_path, target)
+
+
+def download_request(client, cds_request, manifest_path, retries=5):
+    """
+    Retrieves one request unless it is up to date, and records it in the manifest.
+
+    A partial download whose result location is still in the manifest is resumed
+    without submitting the request again.
+
+    Returns:
+    - str: 'skipped' or 'downloaded'.
+    """
+    manifest = load_manifest(manifest_path)
+    if is_up_to_date(cds_request, manifest):
+        print(f'{cds_request.target}: up to date, skipped')
+        return 'skipped'
+
+    target_dir = os.path.dirname(cds_request.target)
+    if target_dir:
+        os.makedirs(target_dir, exist_ok=True)
+
+    req_hash = request_hash(cds_request)
+    entry = manifest.get(cds_request.target, {})
+    location, content_length = None, None
+    if entry.get('request_hash') == req_hash and os.path.exists(f'{cds_request.target}.part'):
+        location, content_length = entry.get('location'), entry.get('size')
+    elif os.path.exists(f'{cds_request.target}.part'):
+        os.remove(f'{cds_request.target}.part')
+
+    start = time.perf_counter()
+    resumed = False
+    if location is not None:
+        try:
+            download_resumable(location, cds_request.target, content_length, retries=1)
+            resumed = True
+        except (requests.RequestException, IOError) as e:
+            print(f'{cds_request.target}: could not resume from {location} ({e!r}), resubmitting')
+
+    if not resumed:
+        if os.path.exists(f'{cds_request.target}.part'):
+            os.remove(f'{cds_request.target}.part')
+        result = client.retrieve(cds_request.dataset, cds_request.request)
+        location, content_length = result.location, result.content_length
+        _update_manifest(manifest_path, cds_request.target, {
+            'dataset': cds_request.dataset,
+            'request_hash': req_hash,
+            'location': location,
+            'size': content_length,
+            'sha256': None,
+        })
+        download_resumable(location, cds_request.target, content_length, retries=retries)
+
+    _update_manifest(manifest_path, cds_request.target, {
+        'dataset': cds_request.dataset,
+        'request_hash': req_hash,
+        'location': location,
+        'size': os.path.getsize(cds_request.target),
+        'sha256': file_sha256(cds_request.target),
+        'downloaded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    })
+    print(f'{cds_request.target}: downloaded in {time.perf_counter() - start:.0f}s')
+    return 'downloaded'
+
+
+def download_all(client, cds_requests, data_dir, max_workers=4, retries=5):
+    """
+    Retrieves all requests concurrently, skipping the ones that are up to date.
+
+    Args:
+    - client: cdsapi.Client (or anything with the same `retrieve(dataset, request)`).
+    - cds_requests (list): CDSRequests.
+    - data_dir (str): Directory of the manifest.
+    - max_workers (int): Requests in flight at once (CDS also limits queued requests per user).
+    - retries (int): Download attempts per request.
+
+    Returns:
+    - dict: {target: 'skipped', 'downloaded' or the error}.
+    """
+    manifest_path = os.path.join(data_dir, MANIFEST_NAME)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cds') as executor:
+        futures = {
+            cds_request.target: executor.submit(download_request, client, cds_request, manifest_path, retries)
+            for cds_request in cds_requests
+        }
+        results = {}
+        for target, future in futures.items():
+            try:
+                results[target] = future.result()
+            except Exception as e:
+                print(f'{target}: failed ({e!r})')
+                results[target] = repr(e)
+    return results
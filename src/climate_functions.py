@@ -4,10 +4,12 @@ from datetime import date
 from dateutil.relativedelta import relativedelta
 import numpy as np
 import pandas as pd
+import xarray as xr
 import streamlit as st
 
 
 from geo_loc import ds_latlon_subset
+from grid_index import get_grid_index
 
 def convert_to_mm_per_month(data):
     data_climatology = data.groupby('time.month').mean()
@@ -17,85 +19,74 @@ def convert_to_mm_per_month(data):
     data_climatology_mm_month = data_climatology * data_climatology.numdays *24 *60 * 60
     return data_climatology_mm_month
 
-# @st.cache_data
-# def extract_cordex_climate_data(lat, lon, _hist, _future):
-#     """
-#     Extracts climate data for a given latitude and longitude from historical and future datasets.
-
-#     Args:
-#     - lat (float): Latitude of the location to extract data for.
-#     - lon (float): Longitude of the location to extract data for.
-#     - hist (xarray.Dataset): Historical climate dataset.
-#     - future (xarray.Dataset): Future climate dataset.
-
-#     Returns:
-#     - df (pandas.DataFrame): DataFrame containing present day and future temperature, precipitation, and wind speed data for each month of the year.
-#     - data_dict (dict): Dictionary containing string representations of the extracted climate data.
-#     """
-#     print(_hist)
-#     hist_temp = _hist['tas']
-#     hist_temp = hist_temp.groupby('time.month').mean()
-#     hist_temp = hist_temp.sel(rlat=lat, rlon=lon, method="nearest") - 273.15
-#     # print(hist_temp.val)
-#     hist_temp_values = hist_temp.values  # Ensure hist_temp.values is called directly
-#     hist_temp_ravel = hist_temp_values.ravel()
-#     hist_temp_str = np.array2string(hist_temp_ravel, precision=3, max_line_width=100)[
-#         1:-1
-#     ]
-
-#     hist_pr = _hist['pr']
-#     hist_pr = convert_to_mm_per_month(hist_pr)
-#     hist_pr = hist_pr.sel(rlat=lat, rlon=lon, method="nearest").values
-
-#     hist_pr_str = np.array2string(hist_pr.ravel(), precision=3, max_line_width=100)[
-#         1:-1
-#     ]
-
-#     future_temp = _future['tas']
-#     future_temp = future_temp.groupby('time.month').mean()
-#     future_temp = future_temp.sel(rlat=lat, rlon=lon, method="nearest") - 273.15
-#     future_temp_values = future_temp.values  # Ensure future_temp.values is called directly
-#     future_temp_ravel = future_temp_values.ravel()  # Ravel the numpy array
-#     future_temp_str = np.array2string(
-#         future_temp_ravel, precision=3, max_line_width=100
-#     )[1:-1]
-
-#     future_pr = _future['pr']
-#     future_pr = convert_to_mm_per_month(future_pr)
-#     future_pr = future_pr.sel(rlat=lat, rlon=lon, method="nearest").values
-#     future_pr_str = np.array2string(future_pr.ravel(), precision=3, max_line_width=100)[
-#         1:-1
-#     ]
-
-#     print("hist_temp: ", len(hist_temp))
-#     print("hist_temp: ", len(hist_pr))
-#     print("future pr: ", len(future_temp))
-#     print("future pr: ", len(future_pr))
-
-#     df_temp = pd.DataFrame(
-#         {
-#             "Present Day Temperature": hist_temp,
-#             "Future Temperature": future_temp,
-#             # "Present Day Precipitation": hist_pr,
-#             # "Future Precipitation": future_pr,
-#             "Month": range(1, 13),
-#         }
-#     )
-#     df_pr = pd.DataFrame(
-#         {
-            
-#             "Present Day Precipitation": hist_pr,
-#             "Future Precipitation": future_pr,
-#             "Month": range(1, 13),
-#         }
-#     )
-#     data_dict = {
-#         "hist_temp": hist_temp_str,
-#         "hist_pr": hist_pr_str,
-#         "future_temp": future_temp_str,
-#         "future_pr": future_pr_str,
-#     }
-#     return df_temp, df_pr, data_dict
+def extract_cordex_climate_data(lat, lon, _hist, _future):
+    """
+    Extracts climate data for a given latitude and longitude from the precomputed
+    historical and future climatology cubes (see cds_api_call.build_cordex_climatology).
+
+    Args:
+    - lat (float): Latitude of the location to extract data for.
+    - lon (float): Longitude of the location to extract data for.
+    - hist (xarray.Dataset): Historical monthly climatology ('tas' in K, 'pr' in mm/month).
+    - future (xarray.Dataset): Future monthly climatology ('tas' in K, 'pr' in mm/month).
+
+    Returns:
+    - df (pandas.DataFrame): DataFrame containing present day and future temperature and precipitation data for each month of the year.
+    """
+    # Both experiments share the CORDEX Africa grid, so the index is built once
+    cell = get_grid_index(_hist, latname='lat', lonname='lon').indexers(lat, lon)
+    hist = _hist.isel(cell)
+    future = _future.isel(cell)
+
+    hist_temp = hist['tas'].values.ravel() - 273.15
+    hist_pr = hist['pr'].values.ravel()
+    future_temp = future['tas'].values.ravel() - 273.15
+    future_pr = future['pr'].values.ravel()
+
+    return pd.DataFrame(
+        {
+            "Present Day Temperature": hist_temp,
+            "Future Temperature": future_temp,
+            "Present Day Precipitation": hist_pr,
+            "Future Precipitation": future_pr,
+            "Month": range(1, 13),
+        }
+    )
+
+def extract_cordex_climate_data_batch(lats, lons, _hist, _future):
+    """
+    Vectorized extract_cordex_climate_data: the climatology of many locations in one pass.
+
+    Args:
+    - lats (array-like): Latitudes of the locations.
+    - lons (array-like): Longitudes of the locations.
+    - hist (xarray.Dataset): Historical monthly climatology ('tas' in K, 'pr' in mm/month).
+    - future (xarray.Dataset): Future monthly climatology ('tas' in K, 'pr' in mm/month).
+
+    Returns:
+    - pandas.DataFrame: 12 rows per location, with a 'point' column (position in lats/lons)
+      and the columns of the df returned by extract_cordex_climate_data.
+    """
+    lats = np.atleast_1d(np.asarray(lats, dtype=float))
+    lons = np.atleast_1d(np.asarray(lons, dtype=float))
+    index = get_grid_index(_hist, latname='lat', lonname='lon')
+    cells = {
+        dim: xr.DataArray(idx, dims='point')
+        for dim, idx in zip(index.dims, index.query(lats, lons))
+    }
+    hist = _hist.isel(cells).transpose('point', 'month')
+    future = _future.isel(cells).transpose('point', 'month')
+
+    return pd.DataFrame(
+        {
+            "point": np.repeat(np.arange(lats.size), 12),
+            "Present Day Temperature": (hist['tas'].values - 273.15).ravel(),
+            "Future Temperature": (future['tas'].values - 273.15).ravel(),
+            "Present Day Precipitation": hist['pr'].values.ravel(),
+            "Future Precipitation": future['pr'].values.ravel(),
+            "Month": np.tile(np.arange(1, 13), lats.size),
+        }
+    )
 
 def convert_prate_mm(data):
     # Convert precipitation rate to accumulation in mm
@@ -121,30 +112,56 @@ def convert_prate_mm(data):
     data_tp.attrs['long_name'] = 'SEAS3 3-monthly total precipitation ensemble mean anomaly for 6 lead-time months, start date in May 2021.'
     return data_tp
 
-def calculate_season_anomalies_location(forecast, hindcast, sub):
+def hindcast_climatology(hindcast_tprate):
+    """
+    Hindcast reference for the seasonal anomalies: the 3-month rolling mean
+    precipitation rate per lead month, averaged over all hindcast years and
+    ensemble members.
+
+    It only depends on the system and start month of the hindcast, so it is
+    computed once and reused for every forecast issue (see anomaly_cache).
+
+    Args:
+    - hindcast_tprate (xarray.DataArray): SEAS5 hindcast 'tprate' with 'number', 'time' and 'forecastMonth'.
+
+    Returns:
+    - xarray.DataArray: Climatology on ('forecastMonth', latitude, longitude).
+    """
+    # Both are means, so averaging members and years first gives the same values
+    # while the rolling window only runs over the reduced (forecastMonth, lat, lon) cube
+    hindcast_mean = hindcast_tprate.mean([dim for dim in ('number', 'time') if dim in hindcast_tprate.dims])
+    return hindcast_mean.rolling(forecastMonth=3).mean()
+
+def calculate_season_anomalies_location(forecast, hindcast, sub, climatology=None):
+    # Crop to the bounding box first, so the rolling means and ensemble reductions
+    # below scale with the region instead of the global SEAS5 grid.
+    # sub = (40, -23, -35, 55) #North, West, South, East  (Africa)
+    forecast_tprate = ds_latlon_subset(forecast.tprate, sub)
+
+    # Hindcast climatology; precomputed for the whole grid when given, since the
+    # rolling mean only runs along forecastMonth
+    if climatology is None:
+        climatology = hindcast_climatology(ds_latlon_subset(hindcast.tprate, sub))
+    else:
+        climatology = ds_latlon_subset(climatology, sub)
+
     # Compute 3-month rolling averages
-    seas5_forecast_3m = forecast.rolling(forecastMonth=3).mean()
-    ds_hindcast_3m = hindcast.rolling(forecastMonth=3).mean()
+    seas5_forecast_3m = forecast_tprate.rolling(forecastMonth=3).mean()
 
-    # Calculate anomalies
-    ds_hindcast_3m_hindcast_mean = ds_hindcast_3m.mean(['number'])
-    seas5_anomalies_3m_202403 = seas5_forecast_3m.tprate - ds_hindcast_3m_hindcast_mean.tprate
+    # Ensemble mean; the anomaly is linear, so the forecast ensemble can be
+    # reduced before subtracting the hindcast climatology
+    seas5_forecast_3m_em = seas5_forecast_3m.mean('number')
 
     # Ensemble mean anomaly
-    seas5_anomalies_3m_202403_em = seas5_anomalies_3m_202403.mean('number')
-    seas5_anomalies_3m_202403_em
+    seas5_anomalies_3m_202403_em = seas5_forecast_3m_em - climatology
 
-    seas5_anomalies_3m_202403_em_tp = convert_prate_mm(seas5_anomalies_3m_202403_em)
-    # print("seas: ", seas5_anomalies_3m_202403_em_tp)
-    
-    # define Africa
-    # sub = (40, -23, -35, 55) #North, West, South, East
-    seas5_location_anomalies_3m_202403_em_tp = ds_latlon_subset(seas5_anomalies_3m_202403_em_tp, sub)
+    seas5_location_anomalies_3m_202403_em_tp = convert_prate_mm(seas5_anomalies_3m_202403_em)
 
     return seas5_location_anomalies_3m_202403_em_tp
 
 def extract_seasonal_data(lat, lon, seasonal_location_data, location_seasons):
-    data = seasonal_location_data.sel(latitude=lat, longitude=lon, method="nearest")
+    index = get_grid_index(seasonal_location_data, latname='latitude', lonname='longitude')
+    data = seasonal_location_data.isel(index.indexers(lat, lon))
     data = data.to_dataframe("anomaly_mm")
 
     def extract_season_str(value):
@@ -172,3 +189,53 @@ def extract_seasonal_data(lat, lon, seasonal_location_data, location_seasons):
 
 
 
+
+def extract_seasonal_data_batch(lats, lons, seasonal_location_data, location_seasons, today=None):
+    """
+    Vectorized extract_seasonal_data: current-season anomaly for many locations in one pass.
+
+    Args:
+    - lats (array-like): Latitudes of the locations.
+    - lons (array-like): Longitudes of the locations.
+    - seasonal_location_data (xarray.DataArray): Output of calculate_season_anomalies_location.
+    - location_seasons (list): Season names to consider, e.g. config['seasons_ke'].
+    - today (datetime.date): Date that defines the current season, defaults to today.
+
+    Returns:
+    - pandas.DataFrame: One row per location with the grid cell used, the season and 'anomaly_mm'
+      (NaN when no configured season covers the current month).
+    """
+    lats = np.atleast_1d(np.asarray(lats, dtype=float))
+    lons = np.atleast_1d(np.asarray(lons, dtype=float))
+    today = today or date.today()
+    current_month = calendar.month_abbr[today.month]
+
+    index = get_grid_index(seasonal_location_data, latname='latitude', lonname='longitude')
+    lat_idx, lon_idx = index.query(lats, lons)
+    points = seasonal_location_data.isel(
+        latitude=xr.DataArray(lat_idx, dims='point'),
+        longitude=xr.DataArray(lon_idx, dims='point'),
+    ).transpose('point', 'forecastMonth')
+
+    # Same rule as extract_seasonal_data: the last listed season containing the current month
+    seasons = np.asarray(seasonal_location_data.valid_time.values).astype('U11')
+    season_mask = np.isin(seasons, location_seasons) & (np.char.find(seasons, current_month) >= 0)
+    matches = np.flatnonzero(season_mask)
+
+    if matches.size:
+        season = seasons[matches[-1]]
+        anomaly = points.values[:, np.argmax(seasons == season)]
+    else:
+        season = None
+        anomaly = np.full(lats.shape, np.nan)
+
+    return pd.DataFrame(
+        {
+            "latitude": lats,
+            "longitude": lons,
+            "grid_latitude": points.latitude.values,
+            "grid_longitude": points.longitude.values,
+            "season": season,
+            "anomaly_mm": anomaly,
+        }
+    )
@@ -0,0 +1,61 @@
+"""
+One consultation: exact-match cache, then semantic cache, then the model.
+"""
+from llm_cache import consultation_key, get_cached_response, put_cached_response
+from llm_stream import stream_consultation
+
+
+def _model_name(llm):
+    return getattr(llm, 'model_name', None) or getattr(llm, 'model', '')
+
+
+def run_consultation(chat_prompt, llm, stream_handler, template, forecast_version,
+                     prompt_inputs, semantic_cache=None):
+    """
+    Answers a consultation, calling the model only for genuinely new questions.
+
+    Args:
+    - chat_prompt (ChatPromptTemplate): The system + human prompt.
+    - llm: Chat model.
+    - stream_handler (StreamHandler): Receives the answer (streamed tokens, or a cached answer at once).
+    - template (str): The prompt template text, part of the cache key.
+    - forecast_version (str): anomaly_cache.seasonal_files_version of the current forecast.
+    - prompt_inputs (dict): Inputs of chat_prompt (user_message, lat, lon, soil, ...).
+    - semantic_cache (SemanticCache): Optional embedding-similarity cache.
+
+    Returns:
+    - str: The answer.
+    - str: Where it came from: "cache", "semantic" or "llm".
+    """
+    key = consultation_key(_model_name(llm), template, **prompt_inputs)
+    output = get_cached_response(key, forecast_version)
+    source = "cache"
+
+    partition, vector = None, None
+    if output is None and semantic_cache is not None:
+        context = {k: v for k, v in prompt_inputs.items() if k not in ("user_message", "lat", "lon")}
+        partition = semantic_cache.partition_key(
+            prompt_inputs["lat"], prompt_inputs["lon"], forecast_version,
+            model=_model_name(llm), template=template, **context,
+        )
+        try:
+            output, similarity, vector = semantic_cache.lookup(prompt_inputs["user_message"], partition)
+            print(f"semantic cache: similarity {similarity:.3f}, stats {semantic_cache.stats}")
+        except Exception as e:
+            print(f"semantic cache lookup failed: {e!r}")
+            output, partition = None, None
+        source = "semantic"
+
+    if output is not None:
+        stream_handler.on_llm_new_token(output)
+        stream_handler.flush()
+        return output, source
+
+    output, _ = stream_consultation(chat_prompt, llm, stream_handler, **prompt_inputs)
+    put_cached_response(key, forecast_version, output)
+    if partition is not None:
+        try:
+            semantic_cache.add(prompt_inputs["user_message"], partition, output, vector)
+        except Exception as e:
+            print(f"semantic cache update failed: {e!r}")
+    return output, "llm"
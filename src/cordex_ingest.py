@@ -0,0 +1,164 @@
+"""
+Ingestion of the CORDEX zip archives into one chunked Zarr store per experiment.
+
+unzip_files extracted every archive to disk and load_hist_proj reopened the
+extracted NetCDFs with open_mfdataset, doubling disk usage and paying a slow
+multi-file open in every process. Here each NetCDF member is read straight
+out of its zip archive, never extracted onto disk, and written into
+`{data_dir}cordex_{experiment}.zarr`:
+
+1. the members are scanned in parallel for their experiment, variable and time
+   axis, reading only the file header and time variable from the archive,
+2. an empty store with the full time axis is created per experiment,
+3. one task per (experiment, variable) writes its members in time order as
+   region writes of that variable only, in parallel across a process pool (tasks
+   never share a Zarr array); compressed members are decompressed into memory
+   once for this, since reading a whole variable seeks back and forth,
+4. the store metadata is consolidated, so opening the store is a single read.
+"""
+import io
+import os
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from glob import glob
+
+import numpy as np
+import xarray as xr
+
+CORDEX_STORES = {
+    'historical': 'cordex_historical.zarr',
+    'rcp45': 'cordex_rcp45.zarr',
+}
+
+_EXPERIMENT_PATTERN = re.compile(r'_(historical|rcp\d+)_')
+
+
+@contextmanager
+def open_zip_member(zip_path, member, in_memory=False):
+    """
+    Opens a NetCDF member of a zip archive as a dataset without extracting it.
+
+    Args:
+    - zip_path (str): Zip archive.
+    - member (str): Name of the NetCDF file in the archive.
+    - in_memory (bool): Decompress a compressed member into memory first, for reading
+      most of it; otherwise it is read from the archive stream, where seeking
+      backwards restarts the decompression.
+    """
+    with zipfile.ZipFile(zip_path) as archive:
+        if in_memory and archive.getinfo(member).compress_type != zipfile.ZIP_STORED:
+            file = io.BytesIO(archive.read(member))
+        else:
+            file = archive.open(member)
+        with file, xr.open_dataset(file, engine='h5netcdf') as ds:
+            yield ds
+
+
+def _scan_member(zip_path, member):
+    variable = os.path.basename(member).split('_')[0]
+    experiment = _EXPERIMENT_PATTERN.search(member).group(1)
+    with open_zip_member(zip_path, member) as ds:
+        if variable not in ds:
+            raise ValueError(f'{zip_path}:{member} has no variable {variable!r}')
+        return {
+            'zip_path': zip_path,
+            'member': member,
+            'experiment': experiment,
+            'variable': variable,
+            'time': ds['time'].values,
+        }
+
+
+def _time_axis(members):
+    """Sorts members in time and assigns each its slice of the combined time axis."""
+    members = sorted(members, key=lambda m: m['time'][0])
+    start = 0
+    for m in members:
+        m['region'] = slice(start, start + len(m['time']))
+        start += len(m['time'])
+    return members, np.concatenate([m['time'] for m in members])
+
+
+def _create_store(store, first_members, time, time_chunk, space_chunk):
+    """Writes the coordinates and empty, chunked arrays of all variables of an experiment."""
+    data_vars = {}
+    with open_zip_member(first_members[0]['zip_path'], first_members[0]['member']) as ds:
+        time_encoding = {k: v for k, v in ds['time'].encoding.items() if k in ('units', 'calendar')}
+        coords = {name: coord.load() for name, coord in ds.coords.items() if 'time' not in coord.dims}
+    for m in first_members:
+        with open_zip_member(m['zip_path'], m['member']) as ds:
+            var = ds[m['variable']].isel(time=0, drop=True).load()
+        chunks = {dim: min(space_chunk, size) for dim, size in var.sizes.items()}
+        chunks['time'] = min(time_chunk, len(time))
+        data_vars[m['variable']] = (
+            xr.zeros_like(var).expand_dims(time=len(time)).chunk(chunks).assign_attrs(var.attrs)
+        )
+
+    template = xr.Dataset(data_vars, coords=coords).assign_coords(time=time)
+    template['time'].encoding.update(time_encoding)
+    # compute=False writes the coordinates now and only the metadata of the data variables
+    template.to_zarr(store, mode='w', compute=False, consolidated=False)
+
+
+def _write_variable(store, variable, members):
+    for m in members:
+        with open_zip_member(m['zip_path'], m['member'], in_memory=True) as ds:
+            # _create_store wrote the coordinates, including time; only the variable is written here
+            part = ds[[variable]]
+            part = part.drop_vars(list(part.coords))
+            part.to_zarr(store, region={'time': m['region']}, mode='r+', consolidated=False)
+        print(f'{store}: wrote {variable} from {m["member"]}')
+    return variable
+
+
+def ingest_cordex_archives(data_dir, max_workers=None, time_chunk=365, space_chunk=64):
+    """
+    Ingests all CORDEX zip archives in data_dir into one Zarr store per experiment.
+
+    Args:
+    - data_dir (str): Directory with the archives downloaded by retrieve_cordex_*.
+    - max_workers (int): Processes of the pool, defaults to the number of CPUs.
+    - time_chunk (int): Days per chunk.
+    - space_chunk (int): Grid cells per chunk along each spatial dimension.
+
+    Returns:
+    - dict: {experiment: store path}.
+    """
+    import zarr  # only the offline ingest needs zarr, not the apps importing CORDEX_STORES
+
+    jobs = []
+    for zip_path in sorted(glob(f'{data_dir}*.zip')):
+        with zipfile.ZipFile(zip_path) as archive:
+            jobs += [(zip_path, m) for m in archive.namelist()
+                     if m.endswith('.nc') and _EXPERIMENT_PATTERN.search(m)]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        scanned = list(executor.map(_scan_member, *zip(*jobs))) if jobs else []
+
+        stores, writes = {}, []
+        for experiment in sorted({m['experiment'] for m in scanned}):
+            by_variable = {}
+            for m in scanned:
+                if m['experiment'] == experiment:
+                    by_variable.setdefault(m['variable'], []).append(m)
+
+            axes = {variable: _time_axis(members) for variable, members in by_variable.items()}
+            time = next(iter(axes.values()))[1]
+            for variable, (_, variable_time) in axes.items():
+                if not np.array_equal(variable_time, time):
+                    raise ValueError(f'{experiment}: {variable} does not cover the same days as the other variables')
+
+            store = f"{data_dir}{CORDEX_STORES.get(experiment, f'cordex_{experiment}.zarr')}"
+            _create_store(store, [members[0] for members, _ in axes.values()], time, time_chunk, space_chunk)
+            stores[experiment] = store
+            writes += [executor.submit(_write_variable, store, variable, members)
+                       for variable, (members, _) in axes.items()]
+
+        for future in writes:
+            future.result()
+
+    for store in stores.values():
+        zarr.consolidate_metadata(store)
+    return stores
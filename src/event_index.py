@@ -0,0 +1,169 @@
+"""
+In-memory spatial index over hazard event tables.
+
+Each table is loaded once into NumPy lat/lon arrays bucketed on a uniform grid
+(events sorted by cell, with one contiguous id range per grid row), so bounding-box
+queries only touch the cells they overlap. Indexes are immutable and swapped on
+refresh, so concurrent queries never see a half-built index.
+
+load_event_indexes loads every table once at startup, from the database or, for
+deployments without Postgres, from Parquet/CSV exports of the tables.
+"""
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from postgres_query import read_data_db, read_events_since
+
+
+class EventIndex:
+    """Uniform grid-bucket index over the 'latitude'/'longitude' columns of an event table."""
+
+    def __init__(self, events, cell_size=0.1):
+        self.cell_size = cell_size
+        self.n_cols = int(np.ceil(360 / cell_size)) + 1
+        self.events = events.reset_index(drop=True)
+
+        lat = self.events['latitude'].to_numpy(dtype=float)
+        lon = self.events['longitude'].to_numpy(dtype=float)
+        rows, cols = self._cell(lat, lon)
+        cells = rows * self.n_cols + cols
+
+        self.order = np.argsort(cells, kind='stable')
+        self.cells = cells[self.order]
+        self.lat = lat[self.order]
+        self.lon = lon[self.order]
+
+    def _cell(self, lat, lon):
+        rows = np.floor((np.asarray(lat, dtype=float) + 90) / self.cell_size).astype(np.int64)
+        cols = np.floor((np.asarray(lon, dtype=float) + 180) / self.cell_size).astype(np.int64)
+        return rows, cols
+
+    @classmethod
+    def from_file(cls, path, cell_size=0.1):
+        """
+        Builds the index from a Parquet or CSV export of an event table.
+
+        Args:
+        - path (str): .parquet or .csv file with 'latitude' and 'longitude' columns.
+        - cell_size (float): Grid bucket size in degrees.
+        """
+        if os.path.splitext(path)[1].lower() == '.parquet':
+            events = pd.read_parquet(path)
+        else:
+            events = pd.read_csv(path)
+        return cls(events, cell_size=cell_size)
+
+    def __len__(self):
+        return len(self.events)
+
+    def query(self, lat_min, lat_max, lon_min, lon_max):
+        """
+        Returns the events inside a lat/lon bounding box.
+
+        Returns:
+        - pandas.DataFrame: Matching rows of the indexed table.
+        """
+        (row_min, row_max), (col_min, col_max) = self._cell([lat_min, lat_max], [lon_min, lon_max])
+        grid_rows = np.arange(row_min, row_max + 1)
+        starts = np.searchsorted(self.cells, grid_rows * self.n_cols + col_min, side='left')
+        stops = np.searchsorted(self.cells, grid_rows * self.n_cols + col_max, side='right')
+
+        candidates = np.concatenate(
+            [np.arange(start, stop) for start, stop in zip(starts, stops)] or [np.empty(0)]
+        ).astype(np.int64)
+        inside = (
+            (self.lat[candidates] >= lat_min) & (self.lat[candidates] <= lat_max) &
+            (self.lon[candidates] >= lon_min) & (self.lon[candidates] <= lon_max)
+        )
+        return self.events.iloc[np.sort(self.order[candidates[inside]])]
+
+    def append(self, new_events):
+        """Returns a new index that also holds new_events."""
+        if len(new_events) == 0:
+            return self
+        events = pd.concat([self.events, new_events], ignore_index=True)
+        return EventIndex(events, cell_size=self.cell_size)
+
+
+_event_indexes = {}
+_refresh_columns = {}
+_lock = threading.Lock()
+
+
+def load_event_index(table_name, refresh_column=None, cell_size=0.1, source=None):
+    """
+    Loads a table into memory and indexes it.
+
+    Args:
+    - table_name (str): Events table, e.g. one of config['table_names'].
+    - refresh_column (str): Monotonic column (event id or timestamp) used by
+      refresh_event_index to fetch only new rows. Without it a refresh reloads the table.
+    - cell_size (float): Grid bucket size in degrees.
+    - source (pandas.DataFrame or str): The events, or a Parquet/CSV file with them,
+      instead of reading the table from the database.
+    """
+    if source is None:
+        index = EventIndex(read_data_db(table_name), cell_size=cell_size)
+    elif isinstance(source, pd.DataFrame):
+        index = EventIndex(source, cell_size=cell_size)
+    else:
+        index = EventIndex.from_file(source, cell_size=cell_size)
+    with _lock:
+        _event_indexes[table_name] = index
+        _refresh_columns[table_name] = refresh_column
+    return index
+
+
+def load_event_indexes(table_names, files=None, refresh_columns=None, cell_size=0.1):
+    """
+    Loads every table once (e.g. config['table_names'] at startup).
+
+    A table that cannot be loaded is left to the database queries of
+    filter_events_within_square.
+
+    Args:
+    - table_names (list): Events tables.
+    - files (dict): {table_name: Parquet/CSV file} for tables read from files instead of the database.
+    - refresh_columns (dict): {table_name: refresh_column}, see load_event_index.
+    - cell_size (float): Grid bucket size in degrees.
+
+    Returns:
+    - dict: {table_name: EventIndex} of the loaded tables.
+    """
+    files = files or {}
+    refresh_columns = refresh_columns or {}
+    indexes = {}
+    for table_name in table_names:
+        try:
+            indexes[table_name] = load_event_index(
+                table_name, refresh_columns.get(table_name), cell_size, source=files.get(table_name)
+            )
+        except Exception as e:
+            print(f"event index: could not load {table_name} ({e!r})")
+    print(f"event index: loaded {', '.join(f'{t} ({len(i)})' for t, i in indexes.items()) or 'no tables'}")
+    return indexes
+
+
+def refresh_event_index(table_name):
+    """Adds rows inserted since the last load/refresh (by refresh_column) to the table's index."""
+    index = _event_indexes[table_name]
+    refresh_column = _refresh_columns.get(table_name)
+    if refresh_column is None or len(index) == 0:
+        return load_event_index(table_name, refresh_column, cell_size=index.cell_size)
+
+    last_seen = index.events[refresh_column].max()
+    if isinstance(last_seen, np.generic):
+        last_seen = last_seen.item()
+    new_events = read_events_since(table_name, refresh_column, last_seen)
+    new_index = index.append(new_events)
+    with _lock:
+        _event_indexes[table_name] = new_index
+    return new_index
+
+
+def get_event_index(table_name):
+    """The loaded index for a table, or None if it is not held in memory."""
+    return _event_indexes.get(table_name)
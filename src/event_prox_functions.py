@@ -1,33 +1,103 @@
-from postgres_query import read_data_db
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from event_index import get_event_index
+from postgres_query import config, read_events_in_bbox
 import numpy as np
+import pandas as pd
+
+
+def square_bounds(lat, lon, distance_from_event):
+    """
+    Boundaries (lat_min, lat_max, lon_min, lon_max) of a square of given distance
+    in kilometers around the center point.
+    """
+    lat_min, lat_max = lat - (distance_from_event / 111), lat + (distance_from_event / 111)
+    lon_min, lon_max = lon - (distance_from_event / (111 * np.cos(np.radians(lat)))), lon + (distance_from_event / (111 * np.cos(np.radians(lat))))
+    return lat_min, lat_max, lon_min, lon_max
 
 
-def filter_events_within_square(lat, lon, table_name, distance_from_event):
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distance in kilometers from one point to arrays of points."""
+    lat, lon, lats, lons = map(np.radians, (lat, lon, lats, lons))
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * 6371.0 * np.arcsin(np.sqrt(a))
+
+
+def filter_events_within_square(lat, lon, table_name, distance_from_event, columns=None, radius=False):
     """
     Filter events within a square of given distance from the center point.
 
+    Tables loaded with event_index.load_event_indexes are answered from memory;
+    otherwise the square (and optionally a true radius) is pushed down to PostGIS,
+    so only the nearby events are read from the database.
+
     Args:
     - lat (float): Latitude of the center point (rounded to 3 decimal places)
     - lon (float): Longitude of the center point (rounded to 3 decimal places)
-    - haz_dat (pandas.DataFrame): Original dataset.
+    - table_name (str): Name of the events table.
     - distance_from_event (float): Distance in kilometers to form a square.
+    - columns (list): Columns to read, defaults to all.
+    - radius (bool): Additionally keep only events within distance_from_event of the point.
 
     Returns:
     - pandas.DataFrame: Reduced dataset containing only events within the square.
     """
 
-    data = read_data_db(table_name)
-
     # Calculate the boundaries of the square
-    lat_min, lat_max = lat - (distance_from_event / 111), lat + (distance_from_event / 111)
-    lon_min, lon_max = lon - (distance_from_event / (111 * np.cos(np.radians(lat)))), lon + (distance_from_event / (111 * np.cos(np.radians(lat))))
+    lat_min, lat_max, lon_min, lon_max = square_bounds(lat, lon, distance_from_event)
+
+    index = get_event_index(table_name)
+    if index is not None:
+        filtered_data = index.query(lat_min, lat_max, lon_min, lon_max)
+        if radius:
+            distances = haversine_km(lat, lon, filtered_data['latitude'].to_numpy(), filtered_data['longitude'].to_numpy())
+            filtered_data = filtered_data[distances <= distance_from_event]
+        if columns is not None:
+            # file-based indexes have no geometry column
+            keep = [*columns, 'geometry'] if 'geometry' in filtered_data.columns else columns
+            filtered_data = filtered_data[list(dict.fromkeys(keep))]
+    else:
+        filtered_data = read_events_in_bbox(
+            table_name, lon_min, lat_min, lon_max, lat_max,
+            columns=columns,
+            within=(lat, lon, distance_from_event) if radius else None,
+        )
+
+    prompt_haz_data = filtered_data.drop(columns=['country', 'geolocation', 'latitude', 'longitude'], errors='ignore')
+
+    return filtered_data, prompt_haz_data
+
+
+def filter_events_all_tables(lat, lon, distance_from_event, tables=None, columns=None, radius=False, max_workers=None):
+    """
+    Runs filter_events_within_square for every event table concurrently.
+
+    Args:
+    - lat (float): Latitude of the center point.
+    - lon (float): Longitude of the center point.
+    - distance_from_event (float): Distance in kilometers to form a square.
+    - tables (list): Tables to query, defaults to config['table_names'].
+
+    Returns:
+    - pandas.DataFrame: Events of all tables, tagged with a 'table_name' column.
+    - pandas.DataFrame: The same without location columns, for the prompt.
+    - dict: Seconds spent per table.
+    """
+    tables = list(tables or config['table_names'])
+
+    def timed_query(table_name):
+        start = time.perf_counter()
+        filtered_data, _ = filter_events_within_square(lat, lon, table_name, distance_from_event, columns, radius)
+        return filtered_data.assign(table_name=table_name), time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(tables) or 1) as executor:
+        results = list(executor.map(timed_query, tables))
 
-    # Filter events within the square
-    filtered_data = data[
-        (data['latitude'] >= lat_min) & (data['latitude'] <= lat_max) &
-        (data['longitude'] >= lon_min) & (data['longitude'] <= lon_max)
-    ]
+    frames = [frame for frame, _ in results]
+    timings = {table_name: seconds for table_name, (_, seconds) in zip(tables, results)}
 
-    prompt_haz_data = filtered_data.drop(columns=['country', 'geolocation', 'latitude', 'longitude'])
+    filtered_data = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    prompt_haz_data = filtered_data.drop(columns=['country', 'geolocation', 'latitude', 'longitude'], errors='ignore')
 
-    return filtered_data, prompt_haz_data
\ No newline at end of file
+    return filtered_data, prompt_haz_data, timings
@@ -1,35 +1,150 @@
 import requests
 from requests.structures import CaseInsensitiveDict
-from requests.exceptions import Timeout
 import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from dotenv import load_dotenv
+import numpy as np
+import pandas as pd
+import rasterio
+import xarray as xr
+from rasterio.warp import transform as transform_coords
+from rasterio.windows import Window
 
+load_dotenv()
 
-def get_lat_lon(location):
+GEOCODE_CACHE_PATH = os.getenv('GEOCODE_CACHE_PATH', '.geocode_cache.sqlite')
+GEOCODE_TTL = 30 * 24 * 3600          # found places are kept for 30 days
+GEOCODE_NEGATIVE_TTL = 24 * 3600      # "not found" answers are kept for a day
+GEOCODE_TIMEOUT = 5
 
-    load_dotenv()
+SOIL_RASTER_PATH = os.getenv('SOIL_RASTER_PATH', './data/soil/wrb_most_probable.tif')
+SOIL_LEGEND_PATH = os.getenv('SOIL_LEGEND_PATH', './data/soil/wrb_most_probable.csv')
+SOIL_CACHE_PRECISION = 2              # ~1 km, coarser than the 250 m SoilGrids pixels
+SOIL_TTL = 90 * 24 * 3600
 
-    GEOCODE_API_KEY = os.getenv('GEOCODE_API')
-    location_query = location
+_soil_legends = {}
 
-    url = f"https://api.geoapify.com/v1/geocode/search?text={location_query}&apiKey={GEOCODE_API_KEY}"
-    print(url)
 
+def _normalize_location(location):
+    """Cache key for a place name: case-folded, punctuation and extra whitespace removed."""
+    return " ".join(re.sub(r"[^\w\s]", " ", location.casefold()).split())
+
+
+def _geocode_db(cache_path):
+    conn = sqlite3.connect(cache_path, timeout=10)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS geocode ("
+        "    key TEXT PRIMARY KEY,"
+        "    lat REAL,"
+        "    lon REAL,"
+        "    expires INTEGER)"
+    )
+    return conn
+
+
+def _geocode_request(location_query):
     headers = CaseInsensitiveDict()
     headers["Accept"] = "application/json"
 
-    resp = requests.get(url, headers=headers)
+    resp = requests.get(
+        "https://api.geoapify.com/v1/geocode/search",
+        params={"text": location_query, "apiKey": os.getenv('GEOCODE_API')},
+        headers=headers,
+        timeout=GEOCODE_TIMEOUT,
+    )
+    resp.raise_for_status()
+
+    features = resp.json().get('features') or []
+    if not features:
+        return None
+    return features[0]['properties']['lat'], features[0]['properties']['lon']
+
+
+def get_lat_lon(location, cache_path=GEOCODE_CACHE_PATH):
+    """
+    Geocodes a place name with Geoapify, through a local SQLite cache.
+
+    Both found places and "not found" answers are cached (with different TTLs).
+    Network errors and timeouts are raised and never cached.
+
+    Returns:
+    tuple: (lat, lon) of the best match.
+
+    Raises:
+    LookupError: If Geoapify has no match for the location.
+    """
+    key = _normalize_location(location)
+    now = int(time.time())
+
+    with closing(_geocode_db(cache_path)) as conn, conn:
+        row = conn.execute(
+            "SELECT lat, lon FROM geocode WHERE key = ? AND expires > ?", (key, now)
+        ).fetchone()
+    if row is None:
+        result = _geocode_request(location)
+        if result is None:
+            row = (None, None)
+            expires = now + GEOCODE_NEGATIVE_TTL
+        else:
+            row = result
+            expires = now + GEOCODE_TTL
+        with closing(_geocode_db(cache_path)) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO geocode (key, lat, lon, expires) VALUES (?, ?, ?, ?)",
+                (key, row[0], row[1], expires),
+            )
 
-    response = resp.json()
-    lat = response['features'][0]['properties']['lat']
-    lon = response['features'][0]['properties']['lon']
+    if row[0] is None:
+        raise LookupError(f"Location not found: {location}")
+    return row[0], row[1]
 
-    return lat, lon
 
-def get_soil_from_api(lat, lon):
+def get_lat_lon_batch(locations, max_workers=8, cache_path=GEOCODE_CACHE_PATH):
+    """
+    Geocodes many place names concurrently against the same cache.
+
+    Names that normalize to the same key are only looked up once.
+
+    Returns:
+    list: (lat, lon) per input location, or None where it was not found or the lookup failed.
+    """
+    unique = {}
+    for location in locations:
+        unique.setdefault(_normalize_location(location), location)
+
+    def lookup(location):
+        try:
+            return get_lat_lon(location, cache_path=cache_path)
+        except (LookupError, requests.RequestException):
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = dict(zip(unique, executor.map(lookup, unique.values())))
+
+    return [results[_normalize_location(location)] for location in locations]
+
+def _soil_db(cache_path):
+    conn = sqlite3.connect(cache_path, timeout=10)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS soil ("
+        "    key TEXT PRIMARY KEY,"
+        "    wrb_class_name TEXT,"
+        "    expires INTEGER)"
+    )
+    return conn
+
+
+def get_soil_from_api(lat, lon, precision=SOIL_CACHE_PRECISION, cache_path=GEOCODE_CACHE_PATH):
     """
     Retrieves the soil type at a given latitude and longitude using the ISRIC SoilGrids API.
 
+    Answers are cached by coordinate rounded to `precision` decimals, so nearby
+    repeat lookups never hit the network. Failures are not cached.
+
     Parameters:
     lat (float): The latitude of the location.
     lon (float): The longitude of the location.
@@ -37,34 +152,129 @@ def get_soil_from_api(lat, lon):
     Returns:
     str: The name of the World Reference Base (WRB) soil class at the given location.
     """
+    lat, lon = round(lat, precision), round(lon, precision)
+    key = f"{lat:.{precision}f},{lon:.{precision}f}"
+    now = int(time.time())
+
+    with closing(_soil_db(cache_path)) as conn, conn:
+        row = conn.execute(
+            "SELECT wrb_class_name FROM soil WHERE key = ? AND expires > ?", (key, now)
+        ).fetchone()
+    if row is not None:
+        return row[0]
+
     try:
         url = f"https://rest.isric.org/soilgrids/v2.0/classification/query?lon={lon}&lat={lat}&number_classes=5"
-        response = requests.get(url, timeout=3)  # Set timeout to 2 seconds
-        data = response.json()
-        return data["wrb_class_name"]
-    except Timeout:
+        response = requests.get(url, timeout=3)
+        response.raise_for_status()
+        wrb_class_name = response.json()["wrb_class_name"]
+    except (requests.RequestException, KeyError, ValueError):
         return "not found"
+
+    with closing(_soil_db(cache_path)) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO soil (key, wrb_class_name, expires) VALUES (?, ?, ?)",
+            (key, wrb_class_name, now + SOIL_TTL),
+        )
+    return wrb_class_name
+
+
+def _soil_legend(legend_path):
+    if legend_path not in _soil_legends:
+        legend = pd.read_csv(legend_path)
+        _soil_legends[legend_path] = dict(zip(legend["value"], legend["wrb_class_name"]))
+    return _soil_legends[legend_path]
+
+
+def get_soil_from_raster(lat, lon, raster_path=SOIL_RASTER_PATH, legend_path=SOIL_LEGEND_PATH):
+    """
+    Reads the WRB soil class at a location from a local (tiled/COG) class raster,
+    e.g. the SoilGrids WRB MostProbable layer clipped to the configured region.
+
+    Only the single block holding the pixel is read. The legend CSV maps raster
+    values to class names (columns: value, wrb_class_name).
+
+    Returns:
+    str or None: The WRB class name, or None if the point is outside the raster or nodata.
+    """
+    with rasterio.open(raster_path) as src:
+        xs, ys = [lon], [lat]
+        if src.crs is not None and src.crs != "EPSG:4326":
+            xs, ys = transform_coords("EPSG:4326", src.crs, xs, ys)
+        row, col = src.index(xs[0], ys[0])
+        if not (0 <= row < src.height and 0 <= col < src.width):
+            return None
+        value = src.read(1, window=Window(col, row, 1, 1))[0, 0]
+        if src.nodata is not None and value == src.nodata:
+            return None
+    return _soil_legend(legend_path).get(int(value))
+
+
+def get_soil_type(lat, lon):
+    """
+    WRB soil class at a location: local raster first, SoilGrids API only on a miss.
+    """
+    if os.path.exists(SOIL_RASTER_PATH) and os.path.exists(SOIL_LEGEND_PATH):
+        try:
+            wrb_class_name = get_soil_from_raster(lat, lon)
+        except rasterio.errors.RasterioError:
+            wrb_class_name = None
+        if wrb_class_name is not None:
+            return wrb_class_name
+    return get_soil_from_api(lat, lon)
     
 
+def _index_runs(mask):
+    """Splits the True positions of a 1D mask into contiguous index slices."""
+    idx = np.flatnonzero(mask)
+    if idx.size == 0:
+        return [slice(0, 0)]
+    breaks = np.flatnonzero(np.diff(idx) != 1) + 1
+    return [slice(run[0], run[-1] + 1) for run in np.split(idx, breaks)]
+
+
 # Define a geographical subset
 def ds_latlon_subset(ds,area,latname='latitude',lonname='longitude'):
     """
      generates a geographical subset of an xarray data array. 
      The latitude and longitude values that are outside the defined area are dropped.
+
+     The area is cut with isel slices on the 1D coordinates, so the common case is a
+     view of the input (and stays lazy for dask-backed data). A box that wraps around
+     the edge of the grid is assembled from two slices: across 0/360 with longitudes
+     converted to -180..180, across the antimeridian of a -180..180 grid with
+     longitudes converted to 0..360.
     """
 
     lon1 = area[1] % 360
     lon2 = area[3] % 360
+    lons = ds[lonname].values % 360
     if lon2 >= lon1:
-        masklon = ( (ds[lonname]<=lon2) & (ds[lonname]>=lon1) ) 
+        masklon = (lons <= lon2) & (lons >= lon1)
     else:
-        masklon = ( (ds[lonname]<=lon2) | (ds[lonname]>=lon1) ) 
-        
-    mask = ((ds[latname]<=area[0]) & (ds[latname]>=area[2])) * masklon
-    dsout = ds.where(mask,drop=True)
-    
+        masklon = (lons <= lon2) | (lons >= lon1)
+
+    lats = ds[latname].values
+    masklat = (lats <= area[0]) & (lats >= area[2])
+
+    dsout = ds.isel({latname: _index_runs(masklat)[0]})
+
+    lon_runs = _index_runs(masklon)
+
+    if len(lon_runs) == 1:
+        dsout = dsout.isel({lonname: lon_runs[0]})
+        if lon2 < lon1:
+            dsout = dsout.assign_coords({lonname: (dsout[lonname].values + 180) % 360 - 180})
+        return dsout
+
+    # The box wraps around the edge of the grid: 0/360 on a 0..360 grid, or the
+    # antimeridian on a -180..180 grid. Pieces go eastwards from the western edge
+    # of the box, and longitudes are converted so that they increase across it.
+    lon_runs.sort(key=lambda run: (lons[run.start] - lon1) % 360)
+    dsout = xr.concat([dsout.isel({lonname: run}) for run in lon_runs], dim=lonname)
     if lon2 < lon1:
-        dsout[lonname] = (dsout[lonname] + 180) % 360 - 180
-        dsout = dsout.sortby(dsout[lonname])        
-    
-    return dsout
\ No newline at end of file
+        dsout = dsout.assign_coords({lonname: (dsout[lonname].values + 180) % 360 - 180})
+    else:
+        dsout = dsout.assign_coords({lonname: dsout[lonname].values % 360})
+
+    return dsout
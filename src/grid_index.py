@@ -0,0 +1,90 @@
+"""
+Nearest-grid-cell lookup for climate datasets.
+
+CORDEX data lives on a rotated-pole grid (rlat/rlon) with 2D geographic lat/lon
+auxiliary coordinates, so geographic points cannot be selected with .sel on the
+dimension coordinates. This module builds a KD-tree over the grid cell centres
+(on the unit sphere, so longitude conventions and wrap-around do not matter)
+once per loaded dataset, and maps geographic points to array indices.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Grids whose index is kept; the app holds a handful (CORDEX, seasonal anomalies)
+MAX_CACHED_INDEXES = 16
+
+_index_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _to_xyz(lat, lon):
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    return np.stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1
+    )
+
+
+class GridPointIndex:
+    """KD-tree over the cell centres of a (possibly curvilinear) 2D grid."""
+
+    def __init__(self, lat2d, lon2d, dims):
+        self.dims = tuple(dims)
+        self.shape = lat2d.shape
+        self.tree = cKDTree(_to_xyz(lat2d.ravel(), lon2d.ravel()))
+
+    def query(self, lats, lons):
+        """
+        Finds the nearest grid cell for one or many geographic points.
+
+        Args:
+        - lats (float or array-like): Latitude(s) in degrees.
+        - lons (float or array-like): Longitude(s) in degrees.
+
+        Returns:
+        - tuple: One index (or index array) per grid dimension, e.g. (rlat_idx, rlon_idx).
+        """
+        _, flat_idx = self.tree.query(_to_xyz(lats, lons))
+        return np.unravel_index(flat_idx, self.shape)
+
+    def indexers(self, lats, lons):
+        """Returns the query result as a dict that can be passed to .isel."""
+        return dict(zip(self.dims, self.query(lats, lons)))
+
+
+def _grid_coords(ds, latname, lonname):
+    lat = ds[latname]
+    lon = ds[lonname]
+    if lat.ndim == 2:
+        return lat.values, lon.values, lat.dims
+    lon2d, lat2d = np.meshgrid(lon.values, lat.values)
+    return lat2d, lon2d, (lat.dims[0], lon.dims[0])
+
+
+def get_grid_index(ds, latname='lat', lonname='lon'):
+    """
+    Returns the GridPointIndex for the grid of a dataset, building it once per grid.
+
+    Indexes are keyed on the identity of the dataset's lat/lon coordinate variables,
+    which stay the same for a dataset loaded once (load_cordex_climatology,
+    get_season_anomalies) and for selections of it, so a lookup costs no pass over
+    the grid. The cache holds the variables themselves, so their ids are not reused
+    while an entry exists. Building a tree takes milliseconds, so nothing is stored on disk.
+    """
+    lat_var, lon_var = ds[latname].variable, ds[lonname].variable
+    key = (id(lat_var), id(lon_var))
+    with _lock:
+        entry = _index_cache.get(key)
+        if entry is not None and entry[0] is lat_var and entry[1] is lon_var:
+            _index_cache.move_to_end(key)
+            return entry[2]
+
+    index = GridPointIndex(*_grid_coords(ds, latname, lonname))
+    with _lock:
+        _index_cache[key] = (lat_var, lon_var, index)
+        while len(_index_cache) > MAX_CACHED_INDEXES:
+            _index_cache.popitem(last=False)
+    return index
@@ -0,0 +1,97 @@
+"""
+Response cache for consultations.
+
+With temperature=0 the answer is fully determined by the prompt inputs, so answers
+are stored in SQLite under a key built from the model, the prompt templates, the
+normalized user message, quantized coordinates and the climate context. Entries
+expire after a TTL, the least recently used ones are evicted beyond max_entries,
+and everything computed from an older seasonal forecast is dropped as soon as
+the forecast files change.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from contextlib import closing
+
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', '.llm_cache.sqlite')
+LLM_CACHE_TTL = 7 * 24 * 3600
+LLM_CACHE_MAX_ENTRIES = 10_000
+
+
+def normalize_message(message):
+    """Case-folded message with punctuation and extra whitespace removed."""
+    return " ".join(re.sub(r"[^\w\s]", " ", message.casefold()).split())
+
+
+def consultation_key(model, template, user_message, lat, lon, precision=2, **context):
+    """
+    Cache key of a consultation.
+
+    Args:
+    - model (str): Model name.
+    - template (str): The prompt templates (system and human), so edits invalidate old answers.
+    - user_message (str): The user's question, normalized before hashing.
+    - lat, lon (float): Location, rounded to `precision` decimals.
+    - context: Remaining prompt inputs (soil, anomaly, ...); floats are rounded to 1 decimal.
+    """
+    def quantize(value):
+        return round(float(value), 1) if isinstance(value, float) else str(value)
+
+    payload = {
+        "model": model,
+        "template": hashlib.sha256(template.encode()).hexdigest(),
+        "user_message": normalize_message(user_message),
+        "lat": round(float(lat), precision),
+        "lon": round(float(lon), precision),
+        "context": {name: quantize(value) for name, value in sorted(context.items())},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def _cache_db(cache_path):
+    conn = sqlite3.connect(cache_path, timeout=10)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS responses ("
+        "    key TEXT PRIMARY KEY,"
+        "    response TEXT,"
+        "    forecast_version TEXT,"
+        "    created INTEGER,"
+        "    last_used INTEGER)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+    return conn
+
+
+def get_cached_response(key, forecast_version, cache_path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL):
+    """The cached answer for a key, or None on a miss, expiry or forecast change."""
+    now = int(time.time())
+    with closing(_cache_db(cache_path)) as conn, conn:
+        row = conn.execute(
+            "SELECT response FROM responses "
+            "WHERE key = ? AND forecast_version = ? AND created > ?",
+            (key, forecast_version, now - ttl),
+        ).fetchone()
+        if row is not None:
+            conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+    return None if row is None else row[0]
+
+
+def put_cached_response(key, forecast_version, response, cache_path=LLM_CACHE_PATH,
+                        max_entries=LLM_CACHE_MAX_ENTRIES):
+    """Stores an answer, dropping entries of other forecast versions and evicting LRU entries."""
+    now = int(time.time())
+    with closing(_cache_db(cache_path)) as conn, conn:
+        conn.execute("DELETE FROM responses WHERE forecast_version != ?", (forecast_version,))
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, response, forecast_version, created, last_used) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, response, forecast_version, now, now),
+        )
+        conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "    SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (max_entries,),
+        )
@@ -0,0 +1,170 @@
+"""
+Long-lived client for the local Ollama server.
+
+Every Streamlit session used to build its own ChatOpenAI client per submit, so
+each consultation opened new connections and the first request after a quiet
+period paid the model load time. ModelClient is created once per process and
+shared by all sessions:
+
+- one pooled, keep-alive HTTP client (OpenAI-compatible endpoint) on a
+  background event loop that lives as long as the process,
+- a warm-up request on startup that loads the model, and a keep_alive refresh
+  after every generation so the model stays in memory between requests,
+- a micro-batching queue: requests that arrive within `batch_window` seconds
+  are grouped, identical prompts share one generation (late joiners get the
+  tokens generated so far replayed), and at most `max_parallel` generations
+  run at once, matching the server's OLLAMA_NUM_PARALLEL slots.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from functools import lru_cache
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+OLLAMA_BASE_URL = os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
+
+_DONE = object()
+
+
+def _messages_key(messages):
+    payload = [(message.type, message.content) for message in messages]
+    return hashlib.sha256(json.dumps(payload).encode()).hexdigest()
+
+
+class ModelClient:
+    """Process-wide chat model client with connection reuse, warm-up and request coalescing."""
+
+    def __init__(self, model="llama3", base_url=OLLAMA_BASE_URL, keep_alive="30m", max_parallel=2,
+                 batch_window=0.02, max_connections=8, timeout=300, temperature=0, warm_up=True):
+        self.model_name = model
+        self.base_url = base_url
+        self.keep_alive = keep_alive
+        self.max_parallel = max_parallel
+        self.batch_window = batch_window
+        self.requests = 0
+        self.generations = 0
+
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._http = httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout)
+        self.llm = ChatOpenAI(
+            openai_api_base=f"{base_url}/v1",
+            api_key="ollama",
+            model=model,
+            temperature=temperature,
+            http_async_client=self._http,
+        )
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='model-client', daemon=True)
+        self._thread.start()
+        self._inflight = {}
+        self._queue = self._call(self._make_queue())
+        self._semaphore = self._call(self._make_semaphore())
+        asyncio.run_coroutine_threadsafe(self._worker(), self._loop)
+        if warm_up:
+            asyncio.run_coroutine_threadsafe(self._warm_up(), self._loop)
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _make_queue(self):
+        return asyncio.Queue()
+
+    async def _make_semaphore(self):
+        return asyncio.Semaphore(self.max_parallel)
+
+    async def _touch(self):
+        """Loads the model (if needed) and keeps it loaded for keep_alive."""
+        response = await self._http.post(
+            "/api/generate", json={"model": self.model_name, "keep_alive": self.keep_alive}
+        )
+        response.raise_for_status()
+
+    async def _warm_up(self):
+        start = time.perf_counter()
+        try:
+            await self._touch()
+            print(f"model client: {self.model_name} loaded in {time.perf_counter() - start:.1f}s")
+        except Exception as e:
+            print(f"model client: warm-up of {self.model_name} failed ({e!r})")
+
+    async def _worker(self):
+        while True:
+            batch = [await self._queue.get()]
+            await asyncio.sleep(self.batch_window)
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            for key, messages, subscriber in batch:
+                if key in self._inflight:
+                    tokens, subscribers = self._inflight[key]
+                    for token in tokens:
+                        subscriber.put(token)
+                    subscribers.append(subscriber)
+                else:
+                    self._inflight[key] = ([], [subscriber])
+                    self._loop.create_task(self._generate(key, messages))
+
+    async def _generate(self, key, messages):
+        tokens, subscribers = self._inflight[key]
+        result = _DONE
+        try:
+            async with self._semaphore:
+                self.generations += 1
+                async for chunk in self.llm.astream(messages):
+                    tokens.append(chunk)
+                    for subscriber in subscribers:
+                        subscriber.put(chunk)
+        except Exception as e:
+            result = e
+        finally:
+            del self._inflight[key]
+            for subscriber in subscribers:
+                subscriber.put(result)
+        try:
+            await self._touch()
+        except Exception as e:
+            print(f"model client: keep_alive refresh failed ({e!r})")
+
+    def stream(self, messages):
+        """
+        Streams the answer to a list of messages as message chunks.
+
+        Safe to call from any thread; the generation itself runs on the client's
+        event loop and is shared with identical concurrent requests.
+        """
+        self.requests += 1
+        subscriber = queue.Queue()
+        request = (_messages_key(messages), messages, subscriber)
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, request)
+        while True:
+            item = subscriber.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    @property
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "generations": self.generations,
+            "in_flight": len(self._inflight),
+        }
+
+
+@lru_cache(maxsize=None)
+def get_model_client(model="llama3", base_url=OLLAMA_BASE_URL, keep_alive="30m", max_parallel=2,
+                     batch_window=0.02):
+    """The process-wide ModelClient for a model, shared by all Streamlit sessions."""
+    return ModelClient(
+        model=model, base_url=base_url, keep_alive=keep_alive,
+        max_parallel=max_parallel, batch_window=batch_window,
+    )
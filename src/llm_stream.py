@@ -0,0 +1,99 @@
+"""
+Token streaming of consultations into the Streamlit UI.
+
+The chat model is streamed (`astream` in async code, `stream` from the Streamlit
+script thread), and tokens are pushed into a StreamHandler that redraws its
+container at most every `min_interval` seconds instead of once per token.
+Time-to-first-token is measured and logged.
+"""
+import time
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+
+class StreamHandler(BaseCallbackHandler):
+    """
+    Taken from here: https://discuss.streamlit.io/t/langchain-stream/43782
+
+    Redraws are throttled: tokens are buffered and the container is re-rendered at
+    most every `min_interval` seconds, plus once more in flush().
+    """
+
+    def __init__(self, container, initial_text="", display_method="markdown", min_interval=0.1):
+        self.container = container
+        self.tokens = [initial_text] if initial_text else []
+        self.display_method = display_method
+        self.min_interval = min_interval
+        self._last_render = 0.0
+        self._pending = False
+
+    @property
+    def text(self):
+        return "".join(self.tokens)
+
+    def _render(self):
+        display_function = getattr(self.container, self.display_method, None)
+        if display_function is not None:
+            display_function(self.text)
+        else:
+            raise ValueError(f"Invalid display_method: {self.display_method}")
+        self._last_render = time.perf_counter()
+        self._pending = False
+
+    def on_llm_new_token(self, token: str, **kwargs) -> None:
+        self.tokens.append(token)
+        self._pending = True
+        if time.perf_counter() - self._last_render >= self.min_interval:
+            self._render()
+
+    def flush(self):
+        """Renders any tokens received since the last redraw."""
+        if self._pending:
+            self._render()
+
+
+class _TokenTimer:
+    """Feeds chunks into a StreamHandler and logs time to first token and total time."""
+
+    def __init__(self, stream_handler):
+        self.stream_handler = stream_handler
+        self.start = time.perf_counter()
+        self.time_to_first_token = None
+
+    def on_chunk(self, chunk):
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - self.start
+            print(f"time to first token: {self.time_to_first_token:.2f}s")
+        self.stream_handler.on_llm_new_token(chunk.content)
+
+    def finish(self):
+        self.stream_handler.flush()
+        print(f"generation finished in {time.perf_counter() - self.start:.2f}s")
+        return self.stream_handler.text, self.time_to_first_token
+
+
+async def astream_consultation(chat_prompt, llm, stream_handler, **inputs):
+    """
+    Streams the model answer for a chat prompt into stream_handler.
+
+    Returns:
+    - str: The full answer.
+    - float: Time to first token in seconds (None if nothing was generated).
+    """
+    timer = _TokenTimer(stream_handler)
+    async for chunk in llm.astream(chat_prompt.format_messages(**inputs)):
+        timer.on_chunk(chunk)
+    return timer.finish()
+
+
+def stream_consultation(chat_prompt, llm, stream_handler, **inputs):
+    """
+    Blocking variant of astream_consultation for the Streamlit script thread.
+
+    Uses the model's synchronous stream, so no event loop is created per request
+    and long-lived clients (see llm_client.ModelClient) keep their connections.
+    """
+    timer = _TokenTimer(stream_handler)
+    for chunk in llm.stream(chat_prompt.format_messages(**inputs)):
+        timer.on_chunk(chunk)
+    return timer.finish()
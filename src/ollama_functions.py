@@ -1,13 +1,17 @@
 import json
+from functools import lru_cache
 from operator import itemgetter
 from typing import (
     Any,
+    AsyncIterator,
     Callable,
     Dict,
+    Iterator,
     List,
     Literal,
     Optional,
     Sequence,
+    Tuple,
     Type,
     TypedDict,
     TypeVar,
@@ -15,17 +19,20 @@ from typing import (
     overload,
 )
 
-from langchain_community.chat_models.ollama import ChatOllama
-from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_community.chat_models.ollama import (
+    ChatOllama,
+    _chat_stream_response_to_chat_generation_chunk,
+)
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
 from langchain_core.language_models import LanguageModelInput
 from langchain_core.messages import AIMessage, BaseMessage
-from output_parsers import OutputParserLike
-from langchain_core.output_parsers.json import JsonOutputParser
-from langchain.output_parsers.pydantic import PydanticOutputParser
-from langchain_core.outputs import ChatGeneration, ChatResult
+from output_parsers import IncrementalJsonParser, OutputParserLike, PartialJsonOutputParser
+from langchain_core.exceptions import OutputParserException
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult, Generation
+from langchain_core.messages import SystemMessage
 from langchain_core.prompts import SystemMessagePromptTemplate
 from langchain_core.pydantic_v1 import BaseModel
-from langchain_core.runnables import Runnable, RunnableLambda
+from langchain_core.runnables import Runnable
 from langchain_core.runnables.base import RunnableMap
 from langchain_core.runnables.passthrough import RunnablePassthrough
 from langchain_core.tools import BaseTool
@@ -85,6 +92,38 @@ def convert_to_ollama_tool(tool: Any) -> Dict:
 
 
 
+@lru_cache(maxsize=32)
+def _tool_system_message(template: str, tools_json: str) -> SystemMessage:
+    """Rendered tool system prompt, built once per (template, tool set)."""
+    return SystemMessagePromptTemplate.from_template(template).format(tools=tools_json)
+
+
+def _tool_parameters(function: Dict) -> Dict:
+    if "parameters" in function:
+        return function["parameters"]
+    parameters = {"type": "object", "properties": function.get("properties", {})}
+    if "required" in function:
+        parameters["required"] = function["required"]
+    return parameters
+
+
+@lru_cache(maxsize=32)
+def _tool_call_schema(tools_json: str) -> Dict:
+    """JSON schema of a tool call for Ollama's `format`, built once per tool set."""
+    options = [
+        {
+            "type": "object",
+            "properties": {
+                "tool": {"type": "string", "enum": [function["name"]]},
+                "tool_input": _tool_parameters(function),
+            },
+            "required": ["tool", "tool_input"],
+        }
+        for function in json.loads(tools_json)
+    ]
+    return options[0] if len(options) == 1 else {"anyOf": options}
+
+
 class _AllReturnType(TypedDict):
     raw: BaseMessage
     parsed: Optional[_DictOrPydantic]
@@ -109,10 +148,32 @@ def parse_response(message: BaseMessage) -> str:
 
 
 
+class ToolInputOutputParser(PartialJsonOutputParser):
+    """Parses `tool_input` of an OllamaFunctions tool call.
+
+    Accepts a generated message (arguments in `function_call`) as well as the
+    streamed raw tool-call JSON, from which partial `tool_input` dicts are emitted.
+    """
+
+    path: Tuple[str, ...] = ("tool_input",)
+
+    def parse_result(self, result: List[Generation], *, partial: bool = False) -> Any:
+        generation = result[0]
+        if isinstance(generation, ChatGeneration) and (
+            "function_call" in generation.message.additional_kwargs
+        ):
+            arguments = parse_response(generation.message)
+            return self._validate(json.loads(arguments) if arguments else {})
+        return super().parse_result(result, partial=partial)
+
+
 class OllamaFunctions(ChatOllama):
     """Function chat model that uses Ollama API."""
 
     tool_system_prompt_template: str = DEFAULT_SYSTEM_TEMPLATE
+    format_schema: bool = True
+    """Constrain decoding with the tool-call JSON schema as Ollama's `format`
+    (Ollama 0.5+). With False, the `format` given by the caller is used."""
 
     def __init__(self, **kwargs: Any) -> None:
         super().__init__(**kwargs)
@@ -256,14 +317,11 @@ class OllamaFunctions(ChatOllama):
                 "Received None."
             )
         llm = self.bind_tools(tools=[schema], format="json")
-        if is_pydantic_schema:
-            output_parser: OutputParserLike = PydanticOutputParser(
-                pydantic_object=schema
-            )
-        else:
-            output_parser = JsonOutputParser()
-
-        parser_chain = RunnableLambda(parse_response) | output_parser
+        # Reads the function_call of a generated message, and the raw tool-call
+        # JSON when streaming, so `answer` fields render as they are generated
+        parser_chain: OutputParserLike = ToolInputOutputParser(
+            pydantic_object=schema if is_pydantic_schema else None
+        )
         if include_raw:
             parser_assign = RunnablePassthrough.assign(
                 parsed=itemgetter("raw") | parser_chain, parsing_error=lambda _: None
@@ -277,13 +335,11 @@ class OllamaFunctions(ChatOllama):
             return llm | parser_chain
 
 
-    def _generate(
-        self,
-        messages: List[BaseMessage],
-        stop: Optional[List[str]] = None,
-        run_manager: Optional[CallbackManagerForLLMRun] = None,
-        **kwargs: Any,
-    ) -> ChatResult:
+    def _prepare_tool_call(
+        self, messages: List[BaseMessage], kwargs: Dict[str, Any]
+    ) -> Tuple[List[Dict], List[BaseMessage], Dict[str, Any]]:
+        """Tool definitions, messages with the tool system prompt, and request kwargs."""
+        kwargs = dict(kwargs)
         functions = kwargs.get("functions", [])
         if "functions" in kwargs:
             del kwargs["functions"]
@@ -301,38 +357,73 @@ class OllamaFunctions(ChatOllama):
             functions.append(DEFAULT_RESPONSE_FUNCTION)
         if _is_pydantic_class(functions[0]):
             functions = [convert_to_ollama_tool(fn) for fn in functions]
-        system_message_prompt_template = SystemMessagePromptTemplate.from_template(
-            self.tool_system_prompt_template
-        )
-        system_message = system_message_prompt_template.format(
-            tools=json.dumps(functions, indent=2)
-        )
-        response_message = super()._generate(
-            [system_message] + messages, stop=stop, run_manager=run_manager, **kwargs
+        tools_json = json.dumps(functions)
+        system_message = _tool_system_message(self.tool_system_prompt_template, tools_json)
+        if self.format_schema:
+            kwargs["format"] = _tool_call_schema(tools_json)
+        return functions, [system_message] + messages, kwargs
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        """Streams plain chat, or the raw tool-call JSON when tools are bound."""
+        if "functions" not in kwargs:
+            yield from super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            return
+        _, messages, kwargs = self._prepare_tool_call(messages, kwargs)
+        for stream_resp in self._create_chat_stream(messages, stop, **kwargs):
+            if stream_resp:
+                chunk = _chat_stream_response_to_chat_generation_chunk(stream_resp)
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.text, chunk=chunk, verbose=self.verbose)
+                yield chunk
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        """Async version of _stream."""
+        if "functions" not in kwargs:
+            async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                yield chunk
+            return
+        _, messages, kwargs = self._prepare_tool_call(messages, kwargs)
+        async for stream_resp in self._acreate_chat_stream(messages, stop, **kwargs):
+            if stream_resp:
+                chunk = _chat_stream_response_to_chat_generation_chunk(stream_resp)
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk, verbose=self.verbose)
+                yield chunk
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        functions, messages, kwargs = self._prepare_tool_call(messages, kwargs)
+        parsed_chat_result = self._stream_tool_call(
+            messages, functions, stop=stop, run_manager=run_manager, **kwargs
         )
-        chat_generation_content = response_message.generations[0].text
-        chat_generation_content = chat_generation_content.rstrip("\n\r")
-        print(chat_generation_content)
-        if not isinstance(chat_generation_content, str):
-            raise ValueError("OllamaFunctions does not support non-string output.")
-        try:
-            parsed_chat_result = json.loads(chat_generation_content)
-        except json.JSONDecodeError:
-            raise ValueError(
-                f"""'{self.model}' did not respond with valid JSON. 
-                Please try again. 
-                Response: {chat_generation_content}"""
-            )
-            
+
         called_tool_name = parsed_chat_result["tool"]
         called_tool_arguments = parsed_chat_result["tool_input"]
         called_tool = next(
             (fn for fn in functions if fn["name"] == called_tool_name), None
         )
         if called_tool is None:
-            raise ValueError(
+            raise OutputParserException(
                 f"Failed to parse a function call from {self.model} output: "
-                f"{chat_generation_content}"
+                f"{json.dumps(parsed_chat_result)}",
+                llm_output=json.dumps(parsed_chat_result),
             )
         if called_tool["name"] == DEFAULT_RESPONSE_FUNCTION["name"]:
             return ChatResult(
@@ -361,6 +452,73 @@ class OllamaFunctions(ChatOllama):
             generations=[ChatGeneration(message=response_message_with_functions)]
         )
 
+    def _stream_tool_call(
+        self,
+        messages: List[BaseMessage],
+        functions: List[Dict],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Dict:
+        """Streams the tool call and parses it while it is generated.
+
+        The generation is stopped as soon as the output can no longer become
+        valid JSON or names a tool that does not exist, and as soon as the JSON
+        object is complete. Output cut off mid-object is repaired.
+        """
+        names = [fn["name"] for fn in functions]
+        parser = IncrementalJsonParser()
+        tool_checked = False
+        stream = self._create_chat_stream(messages, stop, **kwargs)
+        try:
+            for stream_resp in stream:
+                if not stream_resp:
+                    continue
+                chunk = _chat_stream_response_to_chat_generation_chunk(stream_resp)
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.text, chunk=chunk, verbose=self.verbose)
+                parser.feed(chunk.text)
+                if not parser.viable:
+                    raise OutputParserException(
+                        f"'{self.model}' did not respond with valid JSON, "
+                        f"stopped early. Response: {parser.text}",
+                        llm_output=parser.text,
+                    )
+                if parser.complete:
+                    break
+                if tool_checked:
+                    continue
+                partial = parser.value
+                tool = partial.get("tool") if isinstance(partial, dict) else None
+                if isinstance(tool, str):
+                    if tool in names:
+                        tool_checked = True
+                    elif not any(name.startswith(tool) for name in names):
+                        raise OutputParserException(
+                            f"'{self.model}' called unknown tool {tool!r}, stopped early. "
+                            f"Response: {parser.text}",
+                            llm_output=parser.text,
+                        )
+        finally:
+            stream.close()
+
+        parsed_chat_result = parser.finish()
+        if not isinstance(parsed_chat_result, dict) or "tool" not in parsed_chat_result:
+            raise OutputParserException(
+                f"Failed to parse a function call from {self.model} output: "
+                f"{parser.text}",
+                llm_output=parser.text,
+            )
+        if parsed_chat_result["tool"] not in names:
+            # the object can complete (or be repaired) before the tool name was checked
+            raise OutputParserException(
+                f"'{self.model}' called unknown tool {parsed_chat_result['tool']!r}. "
+                f"Response: {parser.text}",
+                llm_output=parser.text,
+            )
+        parsed_chat_result.setdefault("tool_input", {})
+        return parsed_chat_result
+
     @property
     def _llm_type(self) -> str:
         return "ollama_functions"
\ No newline at end of file
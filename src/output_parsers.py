@@ -4,22 +4,34 @@ from abc import ABC, abstractmethod
 from typing import (
     TYPE_CHECKING,
     Any,
+    AsyncIterator,
     Dict,
     Generic,
+    Iterator,
     List,
     Optional,
+    Tuple,
     Type,
     TypeVar,
     Union,
 )
 
+import jsonpatch
 from typing_extensions import get_args
 
+from langchain_core.exceptions import OutputParserException
 from langchain_core.language_models import LanguageModelOutput
-from langchain_core.messages import AnyMessage, BaseMessage
-from langchain_core.outputs import ChatGeneration, Generation
+from langchain_core.messages import AnyMessage, BaseMessage, BaseMessageChunk
+from langchain_core.outputs import (
+    ChatGeneration,
+    ChatGenerationChunk,
+    Generation,
+    GenerationChunk,
+)
+from langchain_core.pydantic_v1 import BaseModel, ValidationError
 from langchain_core.runnables import Runnable, RunnableConfig, RunnableSerializable
 from langchain_core.runnables.config import run_in_executor
+from langchain_core.utils.json import parse_partial_json
 
 if TYPE_CHECKING:
     from langchain_core.prompt_values import PromptValue
@@ -307,4 +319,295 @@ class BaseOutputParser(
             output_parser_dict["_type"] = self._type
         except NotImplementedError:
             pass
-        return output_parser_dict
\ No newline at end of file
+        return output_parser_dict
+
+
+# Characters that may appear outside of strings in JSON (true, false, null, numbers)
+_JSON_BARE_CHARS = frozenset(" \t\r\n,:-+.0123456789eEtruefalsn")
+_JSON_CLOSING = {"}": "{", "]": "["}
+
+
+class IncrementalJsonParser:
+    """Parses a JSON value while a model is still generating it.
+
+    Text is fed chunk by chunk. A small scanner tracks strings and open brackets,
+    so output that can no longer become valid JSON is noticed as soon as it
+    appears (`viable` turns False) and a finished value is noticed without
+    waiting for the end of the generation (`complete` turns True). Prose or a
+    Markdown code fence before the value is skipped, up to `max_prefix` characters.
+
+    Example:
+        .. code-block:: python
+
+            parser = IncrementalJsonParser()
+            for chunk in llm.stream(messages):
+                parser.feed(chunk.content)
+                if not parser.viable or parser.complete:
+                    break
+            result = parser.finish()
+    """
+
+    def __init__(self, max_prefix: int = 200) -> None:
+        self.max_prefix = max_prefix
+        self.text = ""
+        self.viable = True
+        self._start: Optional[int] = None
+        self._end: Optional[int] = None
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def complete(self) -> bool:
+        """Whether the top-level value has been closed."""
+        return self._end is not None
+
+    def feed(self, chunk: str) -> None:
+        """Adds the next chunk of model output."""
+        offset = len(self.text)
+        self.text += chunk
+        if not self.viable or self.complete:
+            return
+        for i, char in enumerate(chunk, offset):
+            if self._start is None:
+                if char in "{[":
+                    self._start = i
+                    self._stack.append(char)
+                elif i >= self.max_prefix:
+                    self.viable = False
+                    return
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._stack.append(char)
+            elif char in _JSON_CLOSING:
+                if self._stack.pop() != _JSON_CLOSING[char]:
+                    self.viable = False
+                    return
+                if not self._stack:
+                    self._end = i + 1
+                    return
+            elif char not in _JSON_BARE_CHARS:
+                self.viable = False
+                return
+
+    @property
+    def value(self) -> Any:
+        """The value parsed so far, with open strings and brackets closed.
+
+        None if no value has started yet or the text is not parseable.
+        """
+        if self._start is None or not self.viable:
+            return None
+        try:
+            return parse_partial_json(self.text[self._start : self._end])
+        except ValueError:
+            return None
+
+    def finish(self) -> Any:
+        """The final value; output cut off mid-value is repaired by closing it.
+
+        Raises:
+            OutputParserException: If the output does not contain usable JSON.
+        """
+        value = self.value
+        if value is None:
+            raise OutputParserException(
+                f"Invalid JSON output: {self.text}", llm_output=self.text
+            )
+        return value
+
+
+class BaseTransformOutputParser(BaseOutputParser[T]):
+    """Base class for an output parser that can handle streaming input."""
+
+    def _transform(self, input: Iterator[Union[str, BaseMessage]]) -> Iterator[T]:
+        for chunk in input:
+            if isinstance(chunk, BaseMessage):
+                yield self.parse_result([ChatGeneration(message=chunk)])
+            else:
+                yield self.parse_result([Generation(text=chunk)])
+
+    async def _atransform(
+        self, input: AsyncIterator[Union[str, BaseMessage]]
+    ) -> AsyncIterator[T]:
+        async for chunk in input:
+            if isinstance(chunk, BaseMessage):
+                yield self.parse_result([ChatGeneration(message=chunk)])
+            else:
+                yield self.parse_result([Generation(text=chunk)])
+
+    def transform(
+        self,
+        input: Iterator[Union[str, BaseMessage]],
+        config: Optional[RunnableConfig] = None,
+        **kwargs: Any,
+    ) -> Iterator[T]:
+        yield from self._transform_stream_with_config(
+            input, self._transform, config, run_type="parser"
+        )
+
+    async def atransform(
+        self,
+        input: AsyncIterator[Union[str, BaseMessage]],
+        config: Optional[RunnableConfig] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[T]:
+        async for chunk in self._atransform_stream_with_config(
+            input, self._atransform, config, run_type="parser"
+        ):
+            yield chunk
+
+
+class BaseCumulativeTransformOutputParser(BaseTransformOutputParser[T]):
+    """Base class for an output parser that re-parses the accumulated output after
+    every chunk and emits each new partial result.
+
+    Partial parses are cheap CPU work, so the async path calls `parse_result`
+    directly instead of hopping to a thread pool for every chunk.
+    """
+
+    diff: bool = False
+    """In streaming mode, whether to yield diffs between the previous and current
+    parsed output, or just the current parsed output.
+    """
+
+    def _diff(self, prev: Optional[T], next: T) -> T:
+        """Convert parsed outputs into a diff format. The semantics of this are
+        up to the output parser."""
+        raise NotImplementedError()
+
+    @staticmethod
+    def _to_generation_chunk(chunk: Union[str, BaseMessage]) -> Generation:
+        if isinstance(chunk, BaseMessageChunk):
+            return ChatGenerationChunk(message=chunk)
+        if isinstance(chunk, BaseMessage):
+            return ChatGenerationChunk(message=BaseMessageChunk(**chunk.dict()))
+        return GenerationChunk(text=chunk)
+
+    def _emit(self, prev_parsed: Optional[T], parsed: T) -> T:
+        return self._diff(prev_parsed, parsed) if self.diff else parsed
+
+    def _transform(self, input: Iterator[Union[str, BaseMessage]]) -> Iterator[Any]:
+        prev_parsed = None
+        acc_gen = None
+        for chunk in input:
+            chunk_gen = self._to_generation_chunk(chunk)
+            acc_gen = chunk_gen if acc_gen is None else acc_gen + chunk_gen
+            parsed = self.parse_result([acc_gen], partial=True)
+            if parsed is not None and parsed != prev_parsed:
+                yield self._emit(prev_parsed, parsed)
+                prev_parsed = parsed
+
+    async def _atransform(
+        self, input: AsyncIterator[Union[str, BaseMessage]]
+    ) -> AsyncIterator[T]:
+        prev_parsed = None
+        acc_gen = None
+        async for chunk in input:
+            chunk_gen = self._to_generation_chunk(chunk)
+            acc_gen = chunk_gen if acc_gen is None else acc_gen + chunk_gen
+            parsed = self.parse_result([acc_gen], partial=True)
+            if parsed is not None and parsed != prev_parsed:
+                yield self._emit(prev_parsed, parsed)
+                prev_parsed = parsed
+
+
+class PartialJsonOutputParser(BaseCumulativeTransformOutputParser[Any]):
+    """Parses JSON output, emitting progressively more complete values while
+    the model streams.
+
+    Chunks are fed to an IncrementalJsonParser, so invalid output fails on the
+    chunk where it becomes invalid rather than after the full generation.
+    Partial values are emitted as dicts; with a `pydantic_object` the complete
+    value is validated and emitted last.
+
+    Example:
+        .. code-block:: python
+
+            parser = PartialJsonOutputParser(pydantic_object=AnswerWithJustification)
+            for partial in (prompt | llm | parser).stream(inputs):
+                if isinstance(partial, dict):
+                    chat_box.markdown(partial.get("answer", ""))
+    """
+
+    path: Tuple[str, ...] = ()
+    """Keys of the part of the JSON value to emit, e.g. ("tool_input",)."""
+
+    pydantic_object: Optional[Type[BaseModel]] = None
+    """Model that the complete value is validated against."""
+
+    def _select(self, value: Any) -> Any:
+        for key in self.path:
+            if not isinstance(value, dict) or key not in value:
+                return None
+            value = value[key]
+        return value
+
+    def _validate(self, value: Any) -> Any:
+        if value is None:
+            raise OutputParserException(f"Missing {'.'.join(self.path)} in JSON output")
+        if self.pydantic_object is None:
+            return value
+        try:
+            return self.pydantic_object.parse_obj(value)
+        except ValidationError as e:
+            name = self.pydantic_object.__name__
+            raise OutputParserException(f"Failed to parse {name} from {value}. Got: {e}")
+
+    def _diff(self, prev: Optional[Any], next: Any) -> Any:
+        """JSON Patch operations that turn the previous partial value into the next."""
+        return jsonpatch.make_patch(prev, next).patch
+
+    def parse_result(self, result: List[Generation], *, partial: bool = False) -> Any:
+        parser = IncrementalJsonParser()
+        parser.feed(result[0].text)
+        if partial:
+            return self._select(parser.value)
+        return self._validate(self._select(parser.finish()))
+
+    def parse(self, text: str) -> Any:
+        return self.parse_result([Generation(text=text)])
+
+    def _feed(self, parser: IncrementalJsonParser, chunk: Union[str, BaseMessage]) -> Any:
+        parser.feed(chunk.content if isinstance(chunk, BaseMessage) else chunk)
+        if not parser.viable:
+            raise OutputParserException(
+                f"Invalid JSON output: {parser.text}", llm_output=parser.text
+            )
+        return self._select(parser.value)
+
+    def _transform(self, input: Iterator[Union[str, BaseMessage]]) -> Iterator[Any]:
+        parser = IncrementalJsonParser()
+        prev_parsed = None
+        for chunk in input:
+            parsed = self._feed(parser, chunk)
+            if parsed is not None and parsed != prev_parsed:
+                yield self._emit(prev_parsed, parsed)
+                prev_parsed = parsed
+        if self.pydantic_object is not None:
+            yield self._validate(self._select(parser.finish()))
+
+    async def _atransform(
+        self, input: AsyncIterator[Union[str, BaseMessage]]
+    ) -> AsyncIterator[Any]:
+        parser = IncrementalJsonParser()
+        prev_parsed = None
+        async for chunk in input:
+            parsed = self._feed(parser, chunk)
+            if parsed is not None and parsed != prev_parsed:
+                yield self._emit(prev_parsed, parsed)
+                prev_parsed = parsed
+        if self.pydantic_object is not None:
+            yield self._validate(self._select(parser.finish()))
+
+    @property
+    def _type(self) -> str:
+        return "partial_json"
@@ -1,22 +1,205 @@
 """
 this script accesses the postgresql database
 return a geodataframe table of disasters, conflict datasets
+
+Engines are created lazily with the pool settings from config['db_pool']. The
+connection URL, including the credentials, is read from the DAAS_DB_URL (or
+DATABASE_URL) environment variable, e.g. from .env; config['db_engine_url'] is
+only a password-less fallback for local databases. Async variants (asyncpg) allow
+several event tables to be fetched concurrently, and stream_data_db reads a
+table in GeoDataFrame chunks through a server-side cursor.
 """
+import asyncio
 import os
+import threading
+from contextlib import asynccontextmanager
+
 import yaml
 import geopandas as gpd
-from sqlalchemy import create_engine
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+load_dotenv()
 
 config_path = os.getenv('CONFIG_PATH', 'config.yaml')
 # print(config_path)
 with open(config_path, 'r') as file:
     config = yaml.safe_load(file)
 
-db_engine_url = config['db_engine_url']
+db_pool = config.get('db_pool', {})
+
+_engine = None
+_lock = threading.Lock()
+
+
+def _pool_options():
+    return dict(
+        pool_size=db_pool.get('pool_size', 5),
+        max_overflow=db_pool.get('max_overflow', 10),
+        pool_recycle=db_pool.get('pool_recycle', 1800),
+        pool_timeout=db_pool.get('pool_timeout', 30),
+        pool_pre_ping=True,
+    )
+
+
+def database_url():
+    """The connection URL: DAAS_DB_URL, DATABASE_URL or config['db_engine_url']."""
+    return os.getenv('DAAS_DB_URL') or os.getenv('DATABASE_URL') or config['db_engine_url']
+
+
+def get_engine():
+    """The process-wide pooled SQLAlchemy engine."""
+    global _engine
+    with _lock:
+        if _engine is None:
+            _engine = create_engine(database_url(), **_pool_options())
+        return _engine
+
+
+@asynccontextmanager
+async def async_engine():
+    """
+    An async (asyncpg) engine for the same database, disposed on exit.
+
+    asyncpg connections are bound to the loop they were opened on and callers
+    typically run each batch of reads in its own asyncio.run, so the engine and
+    its pool only live as long as the reads that share them.
+    """
+    url = make_url(database_url()).set(drivername='postgresql+asyncpg')
+    engine = create_async_engine(url, **_pool_options())
+    try:
+        yield engine
+    finally:
+        await engine.dispose()
+
+
+def _quote(identifier):
+    """Quotes a (possibly schema-qualified) table or column name for use in SQL."""
+    preparer = postgresql.dialect().identifier_preparer
+    return ".".join(preparer.quote(part) for part in identifier.split("."))
+
+
+def _read_postgis(conn, query, params=None, chunksize=None):
+    return gpd.GeoDataFrame.from_postgis(
+        text(query), conn, geom_col="geometry", params=params, chunksize=chunksize
+    )
+
+
+def _table_query(table_name):
+    return f"SELECT * FROM {_quote(table_name)}", {}
+
+
+def _bbox_query(table_name, lon_min, lat_min, lon_max, lat_max, columns=None, within=None):
+    select = "*" if columns is None else ", ".join(
+        _quote(column) for column in dict.fromkeys([*columns, "geometry"])
+    )
+    query = (
+        f"SELECT {select} FROM {_quote(table_name)} "
+        "WHERE geometry && ST_MakeEnvelope(:lon_min, :lat_min, :lon_max, :lat_max, 4326)"
+    )
+    params = dict(lon_min=lon_min, lat_min=lat_min, lon_max=lon_max, lat_max=lat_max)
+    if within is not None:
+        query += (
+            " AND ST_DWithin(geometry::geography,"
+            " ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography, :distance_m)"
+        )
+        params.update(lat=within[0], lon=within[1], distance_m=within[2] * 1000)
+    return query, params
 
-engine = create_engine(db_engine_url)
 
 def read_data_db(table_name):
-    query = f"SELECT * FROM {table_name}"
-    gdf = gpd.GeoDataFrame.from_postgis(query, engine, geom_col="geometry")
-    return gdf
\ No newline at end of file
+    query, params = _table_query(table_name)
+    with get_engine().connect() as conn:
+        gdf = _read_postgis(conn, query, params)
+    return gdf
+
+
+def stream_data_db(table_name, chunksize=50_000):
+    """
+    Yields a table as GeoDataFrame chunks of at most `chunksize` rows, read through a
+    server-side cursor, so the whole table is never held in memory at once.
+    """
+    query, params = _table_query(table_name)
+    with get_engine().connect() as conn:
+        conn = conn.execution_options(stream_results=True, max_row_buffer=chunksize)
+        yield from _read_postgis(conn, query, params, chunksize=chunksize)
+
+
+def ensure_spatial_index(table_name):
+    """
+    Creates the GiST indexes used by read_events_in_bbox, if they do not exist yet:
+    one on the geometry for the bounding-box filter and one on its geography cast
+    for the ST_DWithin radius filter.
+    """
+    index_name = table_name.replace(".", "_")
+    with get_engine().begin() as conn:
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {_quote(index_name + '_geometry_gist')} "
+            f"ON {_quote(table_name)} USING GIST (geometry)"
+        ))
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {_quote(index_name + '_geography_gist')} "
+            f"ON {_quote(table_name)} USING GIST ((geometry::geography))"
+        ))
+
+
+def read_events_in_bbox(table_name, lon_min, lat_min, lon_max, lat_max, columns=None, within=None):
+    """
+    Reads only the events inside a lon/lat bounding box, filtered in PostGIS.
+
+    Args:
+    - table_name (str): Event table with a 'geometry' column in EPSG:4326.
+    - lon_min, lat_min, lon_max, lat_max (float): Bounding box.
+    - columns (list): Columns to select besides the geometry, defaults to all.
+    - within (tuple): Optional (lat, lon, distance_km); keeps only events within a true
+      great-circle radius (ST_DWithin on geography).
+
+    Returns:
+    - geopandas.GeoDataFrame: The matching events.
+    """
+    query, params = _bbox_query(table_name, lon_min, lat_min, lon_max, lat_max, columns, within)
+    with get_engine().connect() as conn:
+        gdf = _read_postgis(conn, query, params)
+    return gdf
+
+
+def read_events_since(table_name, column, value):
+    """Reads the events whose `column` (e.g. an id or timestamp) is greater than `value`."""
+    query = f"SELECT * FROM {_quote(table_name)} WHERE {_quote(column)} > :value"
+    with get_engine().connect() as conn:
+        gdf = _read_postgis(conn, query, {"value": value})
+    return gdf
+
+
+async def _aread(query, params, engine=None):
+    if engine is None:
+        async with async_engine() as engine:
+            return await _aread(query, params, engine)
+    async with engine.connect() as conn:
+        return await conn.run_sync(lambda sync_conn: _read_postgis(sync_conn, query, params))
+
+
+async def aread_data_db(table_name, engine=None):
+    """Async read_data_db; uses a temporary engine unless one of async_engine is given."""
+    return await _aread(*_table_query(table_name), engine)
+
+
+async def aread_events_in_bbox(table_name, lon_min, lat_min, lon_max, lat_max, columns=None, within=None,
+                               engine=None):
+    """Async read_events_in_bbox; uses a temporary engine unless one of async_engine is given."""
+    return await _aread(*_bbox_query(table_name, lon_min, lat_min, lon_max, lat_max, columns, within), engine)
+
+
+async def aread_tables(table_names):
+    """Reads several tables concurrently over one engine, returns {table_name: GeoDataFrame}."""
+    async with async_engine() as engine:
+        frames = await asyncio.gather(*(aread_data_db(table_name, engine) for table_name in table_names))
+    return dict(zip(table_names, frames))
+
+
+if __name__ == "__main__":
+    for table_name in config['table_names']:
+        ensure_spatial_index(table_name)
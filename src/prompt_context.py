@@ -0,0 +1,172 @@
+"""
+Compact, token-budgeted climate context for consultation prompts.
+
+The 12-month CORDEX arrays used to be pasted into the prompt with
+np.array2string(precision=3), which costs several tokens per number. Here the
+context is rendered as a small table (rounded values, future change as deltas,
+seasonal aggregates), each section is measured in tokens, and the lowest-priority
+sections are dropped when the context exceeds the configured budget.
+
+The system prompt, including the legend of the table format, is a plain message
+without template variables that always comes first, so every request shares the
+same prefix and the model server can reuse its cached prefix instead of
+re-processing it.
+"""
+import calendar
+from functools import lru_cache
+
+import numpy as np
+import tiktoken
+from langchain.prompts.chat import ChatPromptTemplate, HumanMessagePromptTemplate
+from langchain_core.messages import SystemMessage
+
+TOKEN_ENCODING = 'cl100k_base'
+DEFAULT_CONTEXT_BUDGET = 400
+
+CONTEXT_LEGEND = """
+The climate context for the location is given as compact tables:
+temp_C is the present-day mean temperature (1971-2000), temp_chg_C the projected change in degrees C (2071-2100, RCP4.5),
+rain_mm the present-day precipitation in mm, rain_chg_pct the projected change in percent.
+The seasonal anomaly is the forecast precipitation anomaly for the current season in mm, relative to the 2002-2022 hindcast.
+"""
+
+HUMAN_TEMPLATE = "{user_message}\nLocation: latitude = {lat}, longitude = {lon}\n{climate_context}"
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception as e:
+        print(f"token counting: {TOKEN_ENCODING} not available ({e!r}), estimating from length")
+        return None
+
+
+def count_tokens(text):
+    """
+    Number of tokens in a text.
+
+    cl100k_base is not the tokenizer of every model we run (e.g. llama3), but it is
+    close enough for budgeting; without the encoding files, 4 characters per token
+    are assumed.
+    """
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+@lru_cache(maxsize=None)
+def build_chat_prompt(system_role):
+    """
+    The consultation prompt: the static system prompt (system_role and the context
+    legend) as a fixed prefix, followed by the per-request HUMAN_TEMPLATE.
+    """
+    return ChatPromptTemplate.from_messages(
+        [SystemMessage(content=system_role + CONTEXT_LEGEND), HumanMessagePromptTemplate.from_template(HUMAN_TEMPLATE)]
+    )
+
+
+def prompt_template_text(system_role):
+    """The full prompt template text, e.g. for consultation cache keys."""
+    return system_role + CONTEXT_LEGEND + HUMAN_TEMPLATE
+
+
+def _row(name, values, fmt):
+    return f"{name}|" + "|".join(format(value, fmt) for value in values)
+
+
+def _pct_change(present, future):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(present > 0, 100 * (future - present) / present, 0.0)
+
+
+def monthly_table(climatology):
+    """
+    Month-by-month table of the CORDEX climatology.
+
+    Args:
+    - climatology (pandas.DataFrame): The df of extract_cordex_climate_data.
+    """
+    temp = climatology["Present Day Temperature"].to_numpy(dtype=float)
+    future_temp = climatology["Future Temperature"].to_numpy(dtype=float)
+    rain = climatology["Present Day Precipitation"].to_numpy(dtype=float)
+    future_rain = climatology["Future Precipitation"].to_numpy(dtype=float)
+    months = [calendar.month_abbr[month] for month in climatology["Month"]]
+    return "\n".join(
+        [
+            "month|" + "|".join(months),
+            _row("temp_C", temp, ".0f"),
+            _row("temp_chg_C", future_temp - temp, "+.1f"),
+            _row("rain_mm", rain, ".0f"),
+            _row("rain_chg_pct", _pct_change(rain, future_rain), "+.0f"),
+        ]
+    )
+
+
+def seasonal_table(climatology, seasons):
+    """
+    Per-season aggregates of the CORDEX climatology: mean temperature, total rain
+    and their projected changes.
+
+    Args:
+    - climatology (pandas.DataFrame): The df of extract_cordex_climate_data.
+    - seasons (list): Season names made of month abbreviations, e.g. config['seasons_ke'].
+    """
+    abbr_to_month = {calendar.month_abbr[month]: month for month in range(1, 13)}
+    by_month = climatology.set_index("Month")
+    lines = ["season|temp_C|temp_chg_C|rain_mm|rain_chg_pct"]
+    for season in seasons:
+        rows = by_month.loc[[abbr_to_month[abbr] for abbr in season.split()]]
+        temp = rows["Present Day Temperature"].mean()
+        future_temp = rows["Future Temperature"].mean()
+        rain = rows["Present Day Precipitation"].sum()
+        future_rain = rows["Future Precipitation"].sum()
+        change = _pct_change(np.array(rain), np.array(future_rain))
+        lines.append(f"{season}|{temp:.1f}|{future_temp - temp:+.1f}|{rain:.0f}|{change:+.0f}")
+    return "\n".join(lines)
+
+
+def build_climate_context(soil=None, seasonal_anomaly=None, climatology=None, seasons=None,
+                          budget=DEFAULT_CONTEXT_BUDGET):
+    """
+    Serializes the location context for the prompt within a token budget.
+
+    Sections in priority order: soil, seasonal anomaly, seasonal aggregates,
+    monthly table. Sections without data are left out; when the total exceeds
+    the budget, sections are dropped starting from the lowest priority.
+
+    Args:
+    - soil (str): Soil class.
+    - seasonal_anomaly (float or str): Current season precipitation anomaly in mm.
+    - climatology (pandas.DataFrame): The df of extract_cordex_climate_data, or None.
+    - seasons (list): Season names for the seasonal aggregates.
+    - budget (int): Maximum number of context tokens.
+
+    Returns:
+    - str: The context.
+    - dict: Tokens per section that was kept, and the names of dropped sections under 'dropped'.
+    """
+    sections = {}
+    if soil is not None:
+        sections["soil"] = f"Soil type: {soil}"
+    if seasonal_anomaly is not None:
+        try:
+            sections["seasonal_anomaly"] = f"Seasonal anomaly: {float(seasonal_anomaly):+.0f} mm"
+        except (TypeError, ValueError):
+            sections["seasonal_anomaly"] = f"Seasonal anomaly: {seasonal_anomaly}"
+    if climatology is not None:
+        if seasons:
+            sections["seasons"] = seasonal_table(climatology, seasons)
+        sections["months"] = monthly_table(climatology)
+
+    tokens = {name: count_tokens(text) for name, text in sections.items()}
+    dropped = []
+    while sections and sum(tokens.values()) > budget:
+        name = list(sections)[-1]
+        dropped.append(name)
+        del sections[name], tokens[name]
+    if dropped:
+        print(f"prompt context over budget ({budget} tokens), dropped: {dropped}")
+
+    return "\n".join(sections.values()), dict(tokens, dropped=dropped)
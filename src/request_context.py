@@ -0,0 +1,87 @@
+"""
+Concurrent gathering of the per-request location context.
+
+Once the coordinates are known, the soil class, seasonal anomaly, CORDEX
+climatology and nearby hazard events are independent of each other. They are
+fetched in parallel, each with its own timeout and a fallback value, so a slow or
+failing source degrades the answer instead of stalling the request, and the
+request takes as long as the slowest source rather than the sum of all of them.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from climate_functions import extract_cordex_climate_data, extract_seasonal_data
+from event_prox_functions import filter_events_all_tables
+from geo_loc import get_soil_type
+
+DEFAULT_TIMEOUT = 10
+
+# Shared across requests; threads still running after their timeout don't block the caller
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='request-context')
+
+# build_climate_context leaves out the climatology section when it is None
+CORDEX_FALLBACK = None
+
+
+def build_enrichers(lat, lon, seasonal_anomalies=None, seasons=None, historical=None,
+                    projection=None, tables=None, distance_from_event=None):
+    """
+    The enrichers for a location, as {name: (function, fallback)}.
+
+    Soil is always included; the seasonal anomaly, CORDEX climatology and hazard
+    events only when their inputs are given.
+    """
+    enrichers = {'soil': (lambda: get_soil_type(lat, lon), "Not known")}
+    if seasonal_anomalies is not None:
+        enrichers['seasonal'] = (
+            lambda: extract_seasonal_data(lat, lon, seasonal_anomalies, seasons),
+            "Not known",
+        )
+    if historical is not None and projection is not None:
+        enrichers['cordex'] = (
+            lambda: extract_cordex_climate_data(lat, lon, historical, projection),
+            CORDEX_FALLBACK,
+        )
+    if tables and distance_from_event is not None:
+        enrichers['hazards'] = (
+            lambda: filter_events_all_tables(lat, lon, distance_from_event, tables=tables)[1],
+            None,
+        )
+    return enrichers
+
+
+def gather_request_context(enrichers, timeouts=None, default_timeout=DEFAULT_TIMEOUT):
+    """
+    Runs the enrichers concurrently.
+
+    Args:
+    - enrichers (dict): {name: (function, fallback)}, see build_enrichers.
+    - timeouts (dict): Seconds per enricher name, e.g. config['enricher_timeouts'].
+    - default_timeout (float): Seconds for enrichers without an entry in timeouts.
+
+    Returns:
+    - dict: {name: result}, with the fallback for enrichers that failed or timed out.
+    - dict: {name: {"seconds": float, "error": str or None}}.
+    """
+    def timed(func):
+        func_start = time.perf_counter()
+        return func(), time.perf_counter() - func_start
+
+    timeouts = timeouts or {}
+    start = time.perf_counter()
+    futures = {name: _executor.submit(timed, func) for name, (func, _) in enrichers.items()}
+
+    results, report = {}, {}
+    for name, future in futures.items():
+        timeout = timeouts.get(name, default_timeout)
+        try:
+            results[name], seconds = future.result(timeout=max(0, start + timeout - time.perf_counter()))
+            report[name] = {"seconds": seconds, "error": None}
+        except Exception as e:
+            future.cancel()
+            error = "timed out" if isinstance(e, TimeoutError) else repr(e)
+            results[name] = enrichers[name][1]
+            report[name] = {"seconds": time.perf_counter() - start, "error": error}
+            print(f"request context: {name} failed ({error}), using fallback")
+
+    return results, report
@@ -0,0 +1,145 @@
+"""
+Semantic cache for consultations.
+
+Questions that mean the same thing ("planting beans in Nakuru", "bean planting near
+Nakuru town") reuse an earlier answer. Messages are embedded with a local model
+(Ollama embeddings) and compared by cosine similarity against earlier questions
+from the same partition: the same grid cell, seasonal forecast version and
+remaining prompt context (soil, anomaly, ...). Each partition is a NumPy matrix
+of unit vectors kept in memory and persisted in SQLite. Like llm_cache, entries
+of older forecast versions are dropped when an answer for a new version is added.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from functools import lru_cache
+
+import numpy as np
+from langchain_community.embeddings import OllamaEmbeddings
+
+SEMANTIC_CACHE_PATH = os.getenv('SEMANTIC_CACHE_PATH', '.semantic_cache.sqlite')
+
+
+class SemanticCache:
+    """Embedding-similarity cache of answers, partitioned by grid cell and forecast version."""
+
+    def __init__(self, embeddings, cache_path=SEMANTIC_CACHE_PATH, threshold=0.9, cell_size=0.25):
+        self.embeddings = embeddings
+        self.cache_path = cache_path
+        self.threshold = threshold
+        self.cell_size = cell_size
+        self.lookups = 0
+        self.hits = 0
+        self._partitions = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+        with closing(self._db()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS semantic ("
+                "    partition TEXT,"
+                "    message TEXT,"
+                "    embedding BLOB,"
+                "    response TEXT,"
+                "    forecast_version TEXT,"
+                "    created INTEGER)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(semantic)")]
+            if "forecast_version" not in columns:
+                conn.execute("ALTER TABLE semantic ADD COLUMN forecast_version TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS semantic_partition ON semantic (partition)")
+
+    def _db(self):
+        return sqlite3.connect(self.cache_path, timeout=10)
+
+    def partition_key(self, lat, lon, forecast_version, **context):
+        """Grid cell of the location, forecast version and a hash of the remaining prompt inputs."""
+        row = int(np.floor(float(lat) / self.cell_size))
+        col = int(np.floor(float(lon) / self.cell_size))
+        context_hash = hashlib.sha256(
+            json.dumps({k: str(v) for k, v in context.items()}, sort_keys=True).encode()
+        ).hexdigest()[:16]
+        partition = f"{row}_{col}_{forecast_version}_{context_hash}"
+        with self._lock:
+            self._versions[partition] = forecast_version
+        return partition
+
+    def _partition(self, partition):
+        if partition not in self._partitions:
+            with closing(self._db()) as conn:
+                rows = conn.execute(
+                    "SELECT embedding, response FROM semantic WHERE partition = ? ORDER BY rowid",
+                    (partition,),
+                ).fetchall()
+            vectors = [np.frombuffer(embedding, dtype=np.float32) for embedding, _ in rows]
+            self._partitions[partition] = (
+                np.vstack(vectors) if vectors else None,
+                [response for _, response in rows],
+            )
+        return self._partitions[partition]
+
+    def _embed(self, message):
+        vector = np.asarray(self.embeddings.embed_query(message), dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def lookup(self, message, partition):
+        """
+        Returns (response, similarity, vector) for the most similar earlier question
+        in the partition, with response None when nothing is above the threshold.
+        The message's embedding `vector` can be passed on to add.
+        """
+        vector = self._embed(message)
+        with self._lock:
+            self.lookups += 1
+            matrix, responses = self._partition(partition)
+            if matrix is None:
+                return None, 0.0, vector
+            similarities = matrix @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None, float(similarities[best]), vector
+            self.hits += 1
+            return responses[best], float(similarities[best]), vector
+
+    def add(self, message, partition, response, vector=None):
+        """
+        Stores an answer for a question in the partition (made by partition_key),
+        dropping the entries of other forecast versions.
+        """
+        if vector is None:
+            vector = self._embed(message)
+        forecast_version = self._versions[partition]
+        with self._lock:
+            self._partitions = {
+                p: entry for p, entry in self._partitions.items() if self._versions.get(p) == forecast_version
+            }
+            self._versions = {p: v for p, v in self._versions.items() if v == forecast_version}
+            matrix, responses = self._partition(partition)
+            with closing(self._db()) as conn, conn:
+                conn.execute("DELETE FROM semantic WHERE forecast_version IS NOT ?", (forecast_version,))
+                conn.execute(
+                    "INSERT INTO semantic (partition, message, embedding, response, forecast_version, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (partition, message, vector.tobytes(), response, forecast_version, int(time.time())),
+                )
+            matrix = vector[None, :] if matrix is None else np.vstack([matrix, vector])
+            self._partitions[partition] = (matrix, responses + [response])
+
+    @property
+    def stats(self):
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+        }
+
+
+@lru_cache(maxsize=None)
+def get_semantic_cache(embedding_model="nomic-embed-text", threshold=0.9, cell_size=0.25):
+    """Process-wide SemanticCache backed by a local Ollama embedding model."""
+    return SemanticCache(
+        OllamaEmbeddings(model=embedding_model), threshold=threshold, cell_size=cell_size
+    )
@@ -0,0 +1,160 @@
+"""
+Tests of the resumable CDS downloads against a local stand-in CDS server.
+
+The server serves one result file with range support and, like a flaky CDS
+download node, can drop the connection halfway through the body. The client
+stand-in only implements `retrieve(dataset, request)`, returning the location of
+that file, which is all download_all needs from a cdsapi.Client.
+
+    python -m pytest tests/test_cds_download.py
+"""
+import hashlib
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import cds_download  # noqa: E402
+from cds_download import MANIFEST_NAME, CDSRequest, download_all, load_manifest, request_hash  # noqa: E402
+
+# Several download chunks, so the part written before a drop is not empty
+PAYLOAD = os.urandom(3 * cds_download.CHUNK_SIZE + 12345)
+
+
+class StandInCDSServer(ThreadingHTTPServer):
+    """Serves PAYLOAD at /result; the first `drops` full-body responses stop halfway."""
+
+    def __init__(self, payload, drops=0):
+        super().__init__(('127.0.0.1', 0), _ResultHandler)
+        self.payload = payload
+        self.drops = drops
+        self.ranges = []
+
+    @property
+    def location(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/result'
+
+
+class _ResultHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        payload = self.server.payload
+        range_header = self.headers.get('Range')
+        self.server.ranges.append(range_header)
+        start = int(range_header[len('bytes='):].rstrip('-')) if range_header else 0
+        if start >= len(payload):
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{len(payload)}')
+            self.end_headers()
+            return
+
+        body = payload[start:]
+        self.send_response(206 if range_header else 200)
+        if range_header:
+            self.send_header('Content-Range', f'bytes {start}-{len(payload) - 1}/{len(payload)}')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.server.drops and not range_header:
+            self.server.drops -= 1
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInClient:
+    """The cdsapi.Client interface download_all uses: retrieve(dataset, request)."""
+
+    def __init__(self, server):
+        self.server = server
+        self.calls = []
+
+    def retrieve(self, dataset, request):
+        self.calls.append((dataset, request))
+        return SimpleNamespace(location=self.server.location, content_length=len(self.server.payload))
+
+
+@pytest.fixture
+def server():
+    server = StandInCDSServer(PAYLOAD, drops=1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(cds_download.time, 'sleep', lambda seconds: None)
+
+
+def make_request(tmp_path):
+    return CDSRequest('seasonal-monthly-single-levels', {'year': '2024', 'month': '05'},
+                      str(tmp_path / 'seasonal' / 'forecast.grib'))
+
+
+def test_download_resumes_after_dropped_connection(server, tmp_path):
+    cds_request = make_request(tmp_path)
+    client = StandInClient(server)
+
+    results = download_all(client, [cds_request], str(tmp_path))
+
+    assert results == {cds_request.target: 'downloaded'}
+    assert len(client.calls) == 1
+    with open(cds_request.target, 'rb') as file:
+        assert file.read() == PAYLOAD
+    assert not os.path.exists(f'{cds_request.target}.part')
+    # The second request continued from the chunks written before the drop
+    assert server.ranges[0] is None
+    resumed_from = int(server.ranges[1][len('bytes='):].rstrip('-'))
+    assert 0 < resumed_from <= len(PAYLOAD) // 2
+
+
+def test_manifest_records_the_download(server, tmp_path):
+    cds_request = make_request(tmp_path)
+
+    download_all(StandInClient(server), [cds_request], str(tmp_path))
+
+    entry = load_manifest(str(tmp_path / MANIFEST_NAME))[cds_request.target]
+    assert entry['dataset'] == cds_request.dataset
+    assert entry['request_hash'] == request_hash(cds_request)
+    assert entry['location'] == server.location
+    assert entry['size'] == len(PAYLOAD)
+    assert entry['sha256'] == hashlib.sha256(PAYLOAD).hexdigest()
+
+
+def test_checksum_match_skips_the_request(server, tmp_path):
+    cds_request = make_request(tmp_path)
+    download_all(StandInClient(server), [cds_request], str(tmp_path))
+    requests_before = len(server.ranges)
+
+    client = StandInClient(server)
+    results = download_all(client, [cds_request], str(tmp_path))
+
+    assert results == {cds_request.target: 'skipped'}
+    assert client.calls == []
+    assert len(server.ranges) == requests_before
+
+
+def test_checksum_mismatch_downloads_again(server, tmp_path):
+    cds_request = make_request(tmp_path)
+    download_all(StandInClient(server), [cds_request], str(tmp_path))
+    with open(cds_request.target, 'r+b') as file:
+        file.write(b'\0' * 16)
+
+    client = StandInClient(server)
+    results = download_all(client, [cds_request], str(tmp_path))
+
+    assert results == {cds_request.target: 'downloaded'}
+    assert len(client.calls) == 1
+    with open(cds_request.target, 'rb') as file:
+        assert file.read() == PAYLOAD